@@ -17,13 +17,17 @@ from dotenv import load_dotenv
 from models.database import db
 from utils.filters import register_custom_filters
 from utils.error_handlers import register_error_handlers
+from utils.db_swap import register_db_swap_handler
+from utils.http_cache import conditional, PAGE_CACHE_CONTROL, DATA_CACHE_CONTROL
+from utils.compression import precompressed
 from utils.breadcrumbs import generate_breadcrumbs
 from utils.populate_db_info import db_last_updated
 from utils.db_queries.all_indices import get_all_indices
-from utils.db_queries.show_index import get_index_data
-from utils.db_queries.all_stocks import get_ticker_tape_stocks, get_top_stocks
+from utils.db_queries.show_index import get_index_data, verify_index
+from utils.db_queries.all_stocks import get_ticker_tape_stocks, get_top_stocks_snapshot
 from utils.db_queries.query_stocks import get_query_stocks
-from utils.db_queries.show_stock import get_stock_data, get_chart_data, get_timeframe_options
+from utils.db_queries.show_stock import get_stock_data, get_chart_data, get_downsampled_chart_data, \
+    get_batch_chart_data, get_timeframe_options, verify_ticker, verify_timeframe
 
 # Load environment variables
 load_dotenv()
@@ -48,16 +52,21 @@ register_custom_filters(app)
 # Register error handlers
 register_error_handlers(app)
 
+# Pick up the new database file after populate_db swaps it in
+register_db_swap_handler(app)
+
 # Make breadcrumbs available to all templates
 @app.context_processor
 def inject_breadcrumbs():
     return {'breadcrumbs': generate_breadcrumbs()}
 
 @app.route("/")
+@conditional(PAGE_CACHE_CONTROL)
 def home():
     return render_template("home.html")
 
 @app.route("/indices")
+@conditional(PAGE_CACHE_CONTROL)
 def all_indices():
     # Load last updated timestamp of populate db
     last_updated = db_last_updated()
@@ -71,6 +80,8 @@ def all_indices():
     )
 
 @app.route("/indices/<string:index_id>")
+@conditional(PAGE_CACHE_CONTROL, validate=verify_index)
+@precompressed
 def show_index(index_id):
     sort_by = request.args.get('sort_by')
     order = request.args.get('order')
@@ -88,6 +99,7 @@ def show_index(index_id):
         order=order,
     )
 
+# Not conditional: the ticker tape changes from one request to the next
 @app.route("/stocks")
 def all_stocks():
     # Load last updated timestamp of populate db
@@ -95,7 +107,7 @@ def all_stocks():
 
     ticker_tape_stocks = get_ticker_tape_stocks()
 
-    top_stocks = get_top_stocks()
+    top_stocks = get_top_stocks_snapshot()
 
     return render_template(
         "all_stocks.html",
@@ -105,13 +117,18 @@ def all_stocks():
     )
 
 @app.route("/query-stocks")
+@conditional(DATA_CACHE_CONTROL)
 def query_stocks():
     query = request.args.get("q", "").strip()
     result = get_query_stocks(query)
     return result
 
 @app.route("/stocks/<string:ticker>")
+@conditional(PAGE_CACHE_CONTROL, validate=verify_ticker)
+@precompressed
 def show_stock(ticker):
+    # Tickers are stored in upper case, /stocks/aapl is the page of AAPL
+    ticker = ticker.upper()
     stock_data = get_stock_data(ticker)
 
     timeframe_options = get_timeframe_options()
@@ -128,11 +145,32 @@ def show_stock(ticker):
         initial_stock_chart_data=initial_stock_chart_data,
     )
 
+def verify_chart_data_args():
+    verify_ticker(request.args.get("ticker", "").strip())
+    verify_timeframe(request.args.get("timeframe", "").strip())
+
 @app.route("/chart-data")
+@conditional(DATA_CACHE_CONTROL, validate=verify_chart_data_args)
+@precompressed
 def chart_data():
-    ticker = request.args.get("ticker", "").strip()
+    ticker = request.args.get("ticker", "").strip().upper()
     timeframe = request.args.get("timeframe", "").strip()
-    data = get_chart_data(ticker, timeframe)
+    # Optional max number of bars, for the small charts
+    max_points = request.args.get("max_points", type=int)
+    if max_points:
+        data = get_downsampled_chart_data(ticker, timeframe, max_points)
+    else:
+        data = get_chart_data(ticker, timeframe)
+    return data
+
+@app.route("/chart-data/batch")
+@conditional(DATA_CACHE_CONTROL)
+@precompressed
+def batch_chart_data():
+    # Lists as repeated or comma separated arguments: ?tickers=AAPL,MSFT&timeframes=1Y&timeframes=5Y
+    tickers = [ticker.strip().upper() for value in request.args.getlist("tickers") for ticker in value.split(",") if ticker.strip()]
+    timeframes = [timeframe.strip() for value in request.args.getlist("timeframes") for timeframe in value.split(",") if timeframe.strip()]
+    data = get_batch_chart_data(tickers, timeframes)
     return data
 
 if __name__ == "__main__":
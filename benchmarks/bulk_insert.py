@@ -0,0 +1,101 @@
+"""
+Benchmark of the bulk-insert write path against the ORM write path.
+
+Writes synthetic daily chart bars into a scratch database, once through
+db.session.add_all (the ORM unit of work) and once through
+db_populate_scripts.bulk_writer.bulk_insert, and reports the time taken
+for each.
+
+Usage:
+    python -m benchmarks.bulk_insert
+    python -m benchmarks.bulk_insert --rows 100000 1000000 --database-uri postgresql://...
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import Session
+from models.database import db, Stock, StockDay
+from db_populate_scripts.bulk_writer import bulk_insert, BULK_BATCH_SIZE
+
+# Number of bars generated for each synthetic stock
+BARS_PER_STOCK = 1000
+
+def synthetic_rows(num_rows, stock_ids):
+    # (stock_id, date, close_price, volume, ema_30, ema_50, ema_200) tuples
+    start = datetime(2020, 1, 1)
+    for i in range(num_rows):
+        stock_id = stock_ids[i // BARS_PER_STOCK]
+        price = 100 + (i % BARS_PER_STOCK) * 0.01
+        yield (stock_id, start + timedelta(days=i % BARS_PER_STOCK), price, 1000 + i, price, price, price)
+
+def reset_tables(engine, num_rows):
+    # Empty the tables and create one stock for every BARS_PER_STOCK rows
+    with Session(engine) as session, session.begin():
+        session.execute(delete(StockDay))
+        session.execute(delete(Stock))
+        stocks = [Stock(ticker=f"T{i}") for i in range(-(-num_rows // BARS_PER_STOCK))]
+        session.add_all(stocks)
+        session.flush()
+        return [stock.id for stock in stocks]
+
+def orm_write(engine, num_rows, stock_ids):
+    columns = ["stock_id", "date", "close_price", "volume", "ema_30", "ema_50", "ema_200"]
+    with Session(engine) as session, session.begin():
+        session.add_all(StockDay(**dict(zip(columns, row))) for row in synthetic_rows(num_rows, stock_ids))
+
+def bulk_write(engine, num_rows, stock_ids, batch_size):
+    columns = ["stock_id", "date", "close_price", "volume", "ema_30", "ema_50", "ema_200"]
+    with engine.begin() as connection:
+        bulk_insert(connection, StockDay.__table__, columns, synthetic_rows(num_rows, stock_ids), batch_size)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ORM vs bulk inserts of chart bars.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument(
+        "--database-uri",
+        help="Database to benchmark against (default: a scratch SQLite file). Its tables are emptied!"
+    )
+    parser.add_argument("--skip-orm", action="store_true", help="Only time the bulk write path")
+    args = parser.parse_args()
+
+    scratch_dir = None
+    database_uri = args.database_uri
+    if not database_uri:
+        scratch_dir = tempfile.TemporaryDirectory()
+        database_uri = f"sqlite:///{os.path.join(scratch_dir.name, 'bulk_insert.db')}"
+
+    engine = create_engine(database_uri)
+    db.metadata.create_all(engine)
+    print(f"Database: {engine.dialect.name}, batch size: {args.batch_size}\n")
+    print(f"{'rows':>10} {'orm (s)':>10} {'bulk (s)':>10} {'speedup':>8}")
+
+    for num_rows in args.rows:
+        orm_time = None
+        if not args.skip_orm:
+            stock_ids = reset_tables(engine, num_rows)
+            orm_time = timed(orm_write, engine, num_rows, stock_ids)
+
+        stock_ids = reset_tables(engine, num_rows)
+        bulk_time = timed(bulk_write, engine, num_rows, stock_ids, args.batch_size)
+
+        orm_text = f"{orm_time:10.2f}" if orm_time is not None else f"{'-':>10}"
+        speedup = f"{orm_time / bulk_time:7.1f}x" if orm_time is not None else f"{'-':>8}"
+        print(f"{num_rows:>10} {orm_text} {bulk_time:10.2f} {speedup}")
+
+    reset_tables(engine, 0)
+    engine.dispose()
+    if scratch_dir:
+        scratch_dir.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Load test of the routes of the web app, fully offline.
+
+Builds a scratch SQLite database with populate_db and the synthetic
+backends of data_collectors.fake_backends, then sends a mix of requests
+like the visitors of the site do (stock and index pages, chart data of the
+timeframe tabs, search suggestions while typing...) to the app in process,
+from concurrent clients, and reports the p50/p95/p99 latency and the
+requests per second of each route.
+
+The results can be saved as a baseline file (JSON), and compared with the
+baseline of a previous run: the report shows the change of each number,
+and the saved file shows it as a diff in git.
+
+Usage:
+    python -m benchmarks.load
+    python -m benchmarks.load --clients 16 --requests 500 --baseline benchmarks/baselines/load.json
+    python -m benchmarks.load --save-baseline benchmarks/baselines/load.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "load.json")
+
+INDEX_IDS = ["sp500", "nasdaq100", "dowjones"]
+INDEX_SORTS = [(None, None), ("weight", "asc"), ("name", "asc"), ("todays_change", "desc"), ("perc_diff", "desc")]
+INDEX_FILTERS = ["dark_green", "green", "yellow", "red", "dark_red"]
+
+# Share of the requests of each route in the mix
+ROUTE_WEIGHTS = {
+    "/": 3,
+    "/indices": 3,
+    "/indices/<index_id>": 12,
+    "/stocks": 8,
+    "/stocks/<ticker>": 20,
+    "/chart-data": 30,
+    "/chart-data/batch": 4,
+    "/query-stocks": 20,
+}
+
+# Share of the stock pages and charts of stocks that are not in the database (cold path)
+COLD_SHARE = 0.05
+
+# Share of the requests revalidating a response the client already has (If-None-Match)
+REVALIDATE_SHARE = 0.2
+
+# Routes with fewer requests in the run are too noisy to fail it on their p95
+MIN_CHECKED_REQUESTS = 100
+
+def configure_environment(args, scratch_dir):
+    # Must run before the project modules are imported, they read it on import
+    os.environ["POLYGON_BACKEND"] = "fake"
+    os.environ["SCRAPE_BACKEND"] = "fake"
+    os.environ["FAKE_BACKEND_TICKERS"] = str(args.tickers)
+    os.environ["FAKE_BACKEND_LATENCY"] = str(args.latency)
+    os.environ["FAKE_BACKEND_SEED"] = str(args.seed)
+    os.environ["POLYGON_RATE_LIMIT"] = "0"
+    os.environ["DATABASE_URI"] = f"sqlite:///{os.path.join(scratch_dir, 'load.db')}"
+    os.environ["DATA_DIR"] = os.path.join(scratch_dir, "data")
+
+def hide_output(quiet):
+    # The output of populate_db and of the stocks fetched from the API in the requests
+    return contextlib.redirect_stdout(open(os.devnull, "w")) if quiet else contextlib.nullcontext()
+
+def build_database(quiet):
+    from db_populate_scripts.populate_db import populate_db
+    with hide_output(quiet):
+        start = time.perf_counter()
+        populate_db(full_rebuild=True)
+        return time.perf_counter() - start
+
+def get_tickers(app):
+    """
+    Returns the tickers of the stocks in the database, most traded first
+    (the popular ones), and the other tickers of the market.
+    """
+    from models.database import db, Stock, StockMaster
+    with app.app_context():
+        db_tickers = db.session.execute(
+            db.select(Stock.ticker).order_by(Stock.volume.desc().nulls_last(), Stock.ticker)
+        ).scalars().all()
+        all_tickers = db.session.execute(db.select(StockMaster.ticker).order_by(StockMaster.ticker)).scalars().all()
+    in_db = set(db_tickers)
+    return db_tickers, [ticker for ticker in all_tickers if ticker not in in_db]
+
+class RequestMix:
+    """
+    Random requests of the visitors of the site: the routes in the shares
+    of ROUTE_WEIGHTS, the popular stocks more often than the others (Zipf),
+    and the search queries as the prefixes typed one letter at a time.
+    """
+    def __init__(self, db_tickers, cold_tickers, seed):
+        from data_collectors.stock_data import TIMEFRAME_OPTIONS
+        self.rng = random.Random(seed)
+        self.db_tickers = db_tickers
+        self.cold_tickers = cold_tickers
+        self.ticker_weights = [1 / (rank + 1) for rank in range(len(db_tickers))]
+        self.routes = list(ROUTE_WEIGHTS)
+        self.route_weights = list(ROUTE_WEIGHTS.values())
+        self.timeframes = list(TIMEFRAME_OPTIONS)
+
+    def ticker(self):
+        if self.cold_tickers and self.rng.random() < COLD_SHARE:
+            return self.rng.choice(self.cold_tickers)
+        return self.rng.choices(self.db_tickers, self.ticker_weights)[0]
+
+    def next(self):
+        """
+        :return: (route, url) of a request
+        """
+        route = self.rng.choices(self.routes, self.route_weights)[0]
+        if route == "/indices/<index_id>":
+            sort_by, order = self.rng.choice(INDEX_SORTS)
+            args = []
+            if sort_by:
+                args.append(f"sort_by={sort_by}&order={order}")
+            if self.rng.random() < 0.2:
+                args += [f"filter={color}" for color in self.rng.sample(INDEX_FILTERS, self.rng.randint(1, 3))]
+            url = f"/indices/{self.rng.choice(INDEX_IDS)}" + (f"?{'&'.join(args)}" if args else "")
+        elif route == "/stocks/<ticker>":
+            url = f"/stocks/{self.ticker()}"
+        elif route == "/chart-data":
+            url = f"/chart-data?ticker={self.ticker()}&timeframe={self.rng.choice(self.timeframes)}"
+            # Small screens ask for fewer points
+            if self.rng.random() < 0.3:
+                url += "&max_points=300"
+        elif route == "/chart-data/batch":
+            tickers = ",".join(self.rng.sample(self.db_tickers, min(5, len(self.db_tickers))))
+            url = f"/chart-data/batch?tickers={tickers}&timeframes=1M,1Y"
+        elif route == "/query-stocks":
+            word = self.ticker() if self.rng.random() < 0.7 else self.rng.choice(self.db_tickers).lower()
+            url = f"/query-stocks?q={word[:self.rng.randint(1, min(4, len(word)))]}"
+        else:
+            url = route
+        return route, url
+
+def run_client(app, db_tickers, cold_tickers, num_requests, seed, results, start_event):
+    """
+    Sends the requests of one client, one after another, and appends
+    (route, status, seconds) of each to results.
+    """
+    client = app.test_client()
+    mix = RequestMix(db_tickers, cold_tickers, seed)
+    etags = {}
+    timings = []
+    start_event.wait()
+    for _ in range(num_requests):
+        route, url = mix.next()
+        headers = {"Accept-Encoding": "gzip, br"}
+        if url in etags and mix.rng.random() < REVALIDATE_SHARE:
+            headers["If-None-Match"] = etags[url]
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        response.get_data()
+        timings.append((route, response.status_code, time.perf_counter() - start))
+        if response.headers.get("ETag"):
+            etags[url] = response.headers["ETag"]
+        response.close()
+    results.extend(timings)
+
+def run_load(app, db_tickers, cold_tickers, clients, num_requests, seed):
+    """
+    Runs the clients at the same time and returns their timings and the
+    wall time of the run.
+    """
+    results = []
+    start_event = threading.Event()
+    threads = [
+        threading.Thread(target=run_client,
+                         args=(app, db_tickers, cold_tickers, num_requests, seed + client, results, start_event))
+        for client in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    start_event.set()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+def summarize(results, wall_time):
+    """
+    Returns {route: {requests, errors, rps, p50_ms, p95_ms, p99_ms}} of the
+    timings, with the totals of all the routes under "all".
+    """
+    routes = {}
+    for route, status, seconds in results:
+        routes.setdefault(route, []).append((status, seconds))
+    routes["all"] = [(status, seconds) for _, status, seconds in results]
+
+    summary = {}
+    for route, timings in routes.items():
+        latencies = np.array([seconds for _, seconds in timings]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary[route] = {
+            "requests": len(timings),
+            "errors": sum(1 for status, _ in timings if status not in (200, 304)),
+            "rps": round(len(timings) / wall_time, 1),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+        }
+    return summary
+
+def format_change(value, base_value):
+    if not base_value:
+        return ""
+    return f"{(value - base_value) * 100 / base_value:+.0f}%"
+
+def print_report(summary, baseline):
+    base_routes = baseline["routes"] if baseline else {}
+    print(f"\n  {'route':<22} {'requests':>8} {'errors':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route in sorted(summary, key=lambda route: (route == "all", route)):
+        stats = summary[route]
+        print(f"  {route:<22} {stats['requests']:>8} {stats['errors']:>6} {stats['rps']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+        base_stats = base_routes.get(route)
+        if base_stats:
+            changes = [format_change(stats[key], base_stats[key]) for key in ["rps", "p50_ms", "p95_ms", "p99_ms"]]
+            print(f"  {'  vs baseline':<22} {'':>8} {'':>6} {changes[0]:>8} {changes[1]:>8} {changes[2]:>8} {changes[3]:>8}")
+
+def get_regressions(summary, baseline, max_regression):
+    """
+    Returns the routes whose p95 latency is more than max_regression %
+    above the baseline, among the routes with enough requests to tell.
+    """
+    regressions = []
+    for route, stats in summary.items():
+        base_stats = baseline["routes"].get(route)
+        if base_stats and base_stats["p95_ms"] and stats["requests"] >= MIN_CHECKED_REQUESTS and \
+                stats["p95_ms"] > base_stats["p95_ms"] * (1 + max_regression / 100):
+            regressions.append(f"{route}: p95 {base_stats['p95_ms']:.2f} -> {stats['p95_ms']:.2f} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the routes of the web app offline.")
+    parser.add_argument("--tickers", type=int, default=1000, help="Number of synthetic tickers in the market")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every fake API call")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data and of the request mix")
+    parser.add_argument("--clients", type=int, default=8, help="Clients sending requests at the same time")
+    parser.add_argument("--requests", type=int, default=250, help="Requests sent by each client")
+    parser.add_argument("--warmup", type=int, default=50,
+                        help="Requests sent by each client before the measured run (0 = measure cold caches)")
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE_FILE, metavar="FILE",
+                        help=f"Compare with this baseline file (default {os.path.relpath(DEFAULT_BASELINE_FILE)})")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE_FILE, metavar="FILE",
+                        help="Save the results as a baseline file")
+    parser.add_argument("--max-regression", type=float, default=50, metavar="PCT",
+                        help="With --baseline, fail when the p95 latency of a route is this much higher")
+    parser.add_argument("--quiet", action="store_true", help="Hide the output of populate_db and of the app")
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.TemporaryDirectory()
+    configure_environment(args, scratch_dir.name)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from app import app
+    from models.database import db
+
+    build_time = build_database(args.quiet)
+    db_tickers, cold_tickers = get_tickers(app)
+    print(f"\nDatabase built in {build_time:.1f}s: {len(db_tickers)} stocks in the database, "
+          f"{len(cold_tickers)} others")
+
+    with hide_output(args.quiet):
+        if args.warmup:
+            run_load(app, db_tickers, cold_tickers, args.clients, args.warmup, args.seed + 10000)
+        results, wall_time = run_load(app, db_tickers, cold_tickers, args.clients, args.requests, args.seed)
+    summary = summarize(results, wall_time)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(f"\nClients: {args.clients}, requests: {args.clients * args.requests}, wall time: {wall_time:.2f}s")
+    print_report(summary, baseline)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump({
+                "settings": {"tickers": args.tickers, "latency": args.latency, "seed": args.seed,
+                             "clients": args.clients, "requests": args.requests, "warmup": args.warmup},
+                "python": platform.python_version(),
+                "routes": summary,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    with app.app_context():
+        db.engine.dispose()
+    scratch_dir.cleanup()
+
+    errors = summary["all"]["errors"]
+    regressions = get_regressions(summary, baseline, args.max_regression) if baseline else []
+    for regression in regressions:
+        print(f"Regression of {regression}")
+    if errors:
+        print(f"{errors} requests failed")
+    if errors or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+End-to-end benchmark of the database population, fully offline.
+
+Runs db_populate_scripts.populate_db.populate_db against a scratch SQLite
+database, with the Polygon API and the slickcharts website replaced by the
+synthetic backends of data_collectors.fake_backends, and reports the wall
+time, the API calls made and the rows stored for each run. The first run
+fills the empty database, the next ones are incremental (or full with
+--full), like the daily runs.
+
+Usage:
+    python -m benchmarks.populate
+    python -m benchmarks.populate --tickers 5000 --latency 0.05 --error-rate 0.01 --runs 2
+"""
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+TABLES = ["stocks_master", "stocks", "indices", "index_holdings",
+          "stock_minute_data", "stock_hour_data", "stock_day_data", "stock_week_data"]
+
+def configure_environment(args, scratch_dir):
+    # Must run before the project modules are imported, they read it on import
+    os.environ["POLYGON_BACKEND"] = "fake"
+    os.environ["SCRAPE_BACKEND"] = "fake"
+    os.environ["FAKE_BACKEND_TICKERS"] = str(args.tickers)
+    os.environ["FAKE_BACKEND_LATENCY"] = str(args.latency)
+    os.environ["FAKE_BACKEND_ERROR_RATE"] = str(args.error_rate)
+    os.environ["FAKE_BACKEND_SEED"] = str(args.seed)
+    os.environ["POLYGON_RATE_LIMIT"] = str(args.rate_limit)
+    os.environ["DATABASE_URI"] = f"sqlite:///{os.path.join(scratch_dir, 'populate.db')}"
+    os.environ["DATA_DIR"] = os.path.join(scratch_dir, "data")
+    if args.workers:
+        os.environ["POPULATE_MAX_WORKERS"] = str(args.workers)
+
+def count_rows(db):
+    from sqlalchemy import text
+    # populate_db may have swapped in a new SQLite file
+    db.engine.dispose()
+    with db.engine.connect() as connection:
+        return {table: connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() for table in TABLES}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark populate_db end to end with offline fake backends.")
+    parser.add_argument("--tickers", type=int, default=2000, help="Number of synthetic tickers in the market")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every fake API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake API calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Max API calls per second (0 = no limit)")
+    parser.add_argument("--workers", type=int, help="Tickers fetched at the same time")
+    parser.add_argument("--runs", type=int, default=1, help="Number of populate runs on the same database")
+    parser.add_argument("--full", action="store_true", help="Full rebuild on every run, not only the first one")
+    parser.add_argument("--memory-limit", type=float, default=0, metavar="MB",
+                        help="Stream chart rows through a spool keeping at most this much in memory (0 = off)")
+    parser.add_argument("--quiet", action="store_true", help="Hide the output of populate_db")
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.TemporaryDirectory()
+    configure_environment(args, scratch_dir.name)
+
+    from app import app
+    from models.database import db
+    from data_collectors import index_data, stock_data
+    from db_populate_scripts.populate_db import populate_db
+
+    results = []
+    for run in range(args.runs):
+        stock_data.rest_client.reset_calls()
+        index_data.session.reset_calls()
+
+        stdout = sys.stdout
+        if args.quiet:
+            sys.stdout = open(os.devnull, "w")
+        try:
+            start = time.perf_counter()
+            populate_db(full_rebuild=args.full or run == 0, memory_limit_mb=args.memory_limit)
+            wall_time = time.perf_counter() - start
+        finally:
+            if args.quiet:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+        with app.app_context():
+            rows = count_rows(db)
+        calls = {**stock_data.rest_client.calls, "scrape": index_data.session.calls.get("get", 0)}
+        errors = {**stock_data.rest_client.errors, "scrape": index_data.session.errors.get("get", 0)}
+        results.append((wall_time, calls, errors, rows))
+
+    print(f"\nTickers: {args.tickers}, latency: {args.latency}s, error rate: {args.error_rate}, seed: {args.seed}")
+    for run, (wall_time, calls, errors, rows) in enumerate(results):
+        mode = "full" if args.full or run == 0 else "incremental"
+        print(f"\nRun {run + 1} ({mode}): {wall_time:.2f}s")
+        print(f"  {'api endpoint':<24} {'calls':>8} {'errors':>8}")
+        for endpoint in sorted(calls):
+            print(f"  {endpoint:<24} {calls[endpoint]:>8} {errors.get(endpoint, 0):>8}")
+        print(f"  {'total':<24} {sum(calls.values()):>8} {sum(errors.values()):>8}")
+        print(f"  {'table':<24} {'rows':>8}")
+        for table in TABLES:
+            print(f"  {table:<24} {rows[table]:>8}")
+
+    # ru_maxrss is in KB on Linux (bytes on macOS)
+    print(f"\nPeak memory (RSS): {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    with app.app_context():
+        db.engine.dispose()
+    scratch_dir.cleanup()
+
+if __name__ == "__main__":
+    main()
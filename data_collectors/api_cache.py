@@ -0,0 +1,177 @@
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import date, datetime
+from utils.datetime_utils import polygon_timestamp_et, to_naive_et, DATE_FORMAT
+
+# Max number of cached items (list elements, or 1 for other results) kept
+# by a MemoizedClient before the least recently used results are dropped
+API_CACHE_MAX_ITEMS = 100_000
+
+def normalize_value(value):
+    # Same value -> same key, however the caller spelled it
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_value(item) for item in value)
+    return str(value)
+
+
+class MemoizedClient:
+    """
+    Wraps a polygon RESTClient and memoizes the results of the endpoints in
+    'endpoints', keyed by the endpoint name and its normalized parameters.
+    Memoization only happens inside a run (start_run ... end_run), so that
+    results never outlive one database population run.
+
+    list_aggs results with a 'YYYY-MM-DD' start date are range-aware: the
+    cache key leaves out 'from_', 'sort' and 'limit', and a cached result
+    is reused for any request that starts on or after the cached start
+    date, by filtering, sorting and limiting the cached bars locally.
+    """
+    def __init__(self, client, endpoints=("get_ticker_types", "list_aggs"), max_items=API_CACHE_MAX_ITEMS):
+        self._client = client
+        self.endpoints = set(endpoints)
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.active = False
+        self.cache = OrderedDict()  # key -> (result, num_items)
+        self.num_items = 0
+        self.pending = {}  # key -> Future, so concurrent misses share one call
+        self.hits = {}
+        self.misses = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self.endpoints or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def memoized_call(*args, **kwargs):
+            if not self.active:
+                return attr(*args, **kwargs)
+            return self.call(name, attr, args, kwargs)
+
+        return memoized_call
+
+    def start_run(self):
+        with self.lock:
+            self.clear()
+            self.active = True
+
+    def end_run(self):
+        """
+        Stops memoizing and drops all the cached results.
+        :return: dict of endpoint -> {"hits": int, "misses": int} for the run
+        """
+        with self.lock:
+            stats = self.stats()
+            self.active = False
+            self.clear()
+        return stats
+
+    def stats(self):
+        return {
+            endpoint: {"hits": self.hits.get(endpoint, 0), "misses": self.misses.get(endpoint, 0)}
+            for endpoint in sorted(set(self.hits) | set(self.misses))
+        }
+
+    def clear(self):
+        self.cache.clear()
+        self.num_items = 0
+        self.hits = {}
+        self.misses = {}
+
+    def call(self, name, method, args, kwargs):
+        params = inspect.signature(method).bind(*args, **kwargs).arguments
+        from_date = params.get("from_")
+        if name == "list_aggs" and isinstance(from_date, str) and len(from_date) == len("YYYY-MM-DD"):
+            return self.call_list_aggs(method, params)
+
+        key = (name, tuple(sorted((param, normalize_value(value)) for param, value in params.items())))
+        return self.cached(name, key, lambda: method(*args, **kwargs))
+
+    def call_list_aggs(self, method, params):
+        range_params = {param: value for param, value in params.items() if param not in ("from_", "sort", "limit")}
+        key = ("list_aggs", tuple(sorted((param, normalize_value(value)) for param, value in range_params.items())))
+        from_date = params["from_"]
+
+        # Always fetch ascending and unlimited, sort and limit locally
+        def fetch():
+            return from_date, list(method(**{**params, "sort": "asc", "limit": 50000}))
+
+        while True:
+            with self.lock:
+                entry = self.cache.get(key)
+                if entry and entry[0][0] <= from_date:
+                    self.cache.move_to_end(key)
+                    self.hits["list_aggs"] = self.hits.get("list_aggs", 0) + 1
+            if entry and entry[0][0] <= from_date:
+                cached_from, bars = entry[0]
+            else:
+                cached_from, bars = self.cached("list_aggs", key, fetch, replace=True)
+            # A concurrent call of the same key may have fetched a later start
+            # date than this one asked for: fetch again rather than lose bars
+            if cached_from <= from_date:
+                break
+
+        if cached_from < from_date:
+            start = datetime.strptime(from_date, DATE_FORMAT)
+            bars = [bar for bar in bars if to_naive_et(polygon_timestamp_et(bar.timestamp, "millisecond")) >= start]
+        if params.get("sort") == "desc":
+            bars = bars[::-1]
+        limit = params.get("limit")
+        if limit is not None:
+            bars = bars[:int(limit)]
+        return bars
+
+    def cached(self, endpoint, key, fetch, replace=False):
+        with self.lock:
+            if key in self.cache and not replace:
+                self.cache.move_to_end(key)
+                self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+                return self.cache[key][0]
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.pending[key] = future
+                self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+            else:
+                self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = fetch()
+            if inspect.isgenerator(result) or isinstance(result, map):
+                result = list(result)
+        except Exception as e:
+            with self.lock:
+                self.pending.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            self.pending.pop(key, None)
+            self.store(key, result)
+        future.set_result(result)
+        return result
+
+    def store(self, key, result):
+        # Called with the lock held
+        if key in self.cache:
+            self.num_items -= self.cache.pop(key)[1]
+        num_items = len(result[1]) if isinstance(result, tuple) else (len(result) if isinstance(result, list) else 1)
+        self.cache[key] = (result, num_items)
+        self.num_items += num_items
+        while self.num_items > self.max_items and len(self.cache) > 1:
+            _, (_, evicted_items) = self.cache.popitem(last=False)
+            self.num_items -= evicted_items
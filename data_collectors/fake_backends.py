@@ -0,0 +1,319 @@
+"""
+Offline stand-ins for the Polygon API and the slickcharts website, used to
+run and time the database population without network access.
+
+FakeRESTClient implements the RESTClient endpoints used by this project and
+FakeScrapeSession the requests.Session.get used to scrape the indices. Both
+serve deterministic synthetic data for a universe of 'num_tickers' tickers
+(the same 'seed' always gives the same data, in any call order), and can
+add a fixed latency and a deterministic error rate to every call.
+
+They are selected with POLYGON_BACKEND=fake and SCRAPE_BACKEND=fake, and
+configured with the FAKE_BACKEND_* environment variables below.
+"""
+
+import hashlib
+import itertools
+import math
+import os
+import string
+import threading
+import time
+from datetime import date, datetime, timedelta
+import pytz
+import requests
+from polygon.exceptions import BadResponse
+from polygon.rest.models import Agg, Branding, IndicatorValue, RelatedCompany, SingleIndicatorResults, Ticker, \
+    TickerDetails, TickerSnapshot, TickerTypes
+
+FAKE_BACKEND_TICKERS = int(os.getenv("FAKE_BACKEND_TICKERS", "2000"))
+FAKE_BACKEND_LATENCY = float(os.getenv("FAKE_BACKEND_LATENCY", "0"))
+FAKE_BACKEND_ERROR_RATE = float(os.getenv("FAKE_BACKEND_ERROR_RATE", "0"))
+FAKE_BACKEND_SEED = int(os.getenv("FAKE_BACKEND_SEED", "0"))
+
+# Number of holdings of each index page, by the last part of its url
+FAKE_INDEX_SIZES = {
+    "sp500": 503,
+    "nasdaq100": 101,
+    "dowjones": 30,
+    "magnificent7": 7,
+    "berkshire-hathaway": 40,
+    "ARKK": 35,
+}
+# Holdings are picked among the largest tickers of the universe
+FAKE_INDEX_UNIVERSE = 600
+
+FAKE_TICKER_TYPES = {"CS": "Common Stock", "ETF": "Exchange Traded Fund", "ADRC": "American Depository Receipt Common"}
+
+EASTERN_TZ = pytz.timezone("US/Eastern")
+EPOCH = datetime(1970, 1, 1)
+
+def stable_hash(*parts):
+    # Same parts -> same 64-bit number, in every process (unlike hash())
+    digest = hashlib.md5("|".join(str(part) for part in parts).encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def unit_noise(key, step):
+    # Cheap deterministic number in [0, 1) for an integer key and step
+    value = (key ^ (step * 0x9E3779B97F4A7C15)) & 0xFFFFFFFFFFFFFFFF
+    value = (value ^ (value >> 31)) * 0xBF58476D1CE4E5B9 & 0xFFFFFFFFFFFFFFFF
+    value ^= value >> 29
+    return value / 2 ** 64
+
+def fake_tickers(num_tickers):
+    # 'AA', 'AB', ..., 'ZZ', 'AAA', ... as many as needed
+    tickers = []
+    length = 2
+    while len(tickers) < num_tickers:
+        for letters in itertools.product(string.ascii_uppercase, repeat=length):
+            tickers.append("".join(letters))
+            if len(tickers) == num_tickers:
+                break
+        length += 1
+    return tickers
+
+def to_naive_datetime(value, end_of_day=False):
+    # Polygon 'from_' / 'to' arguments as naive ET datetimes
+    if isinstance(value, int):
+        return datetime.fromtimestamp(value / 1000, tz=EASTERN_TZ).replace(tzinfo=None)
+    if isinstance(value, datetime):
+        return value.astimezone(EASTERN_TZ).replace(tzinfo=None) if value.tzinfo else value
+    if isinstance(value, date):
+        value = datetime(value.year, value.month, value.day)
+    else:
+        value = datetime.strptime(value[:10], "%Y-%m-%d")
+    return value + timedelta(days=1) if end_of_day else value
+
+def bar_times(timespan, start, end):
+    """
+    Yields the naive ET start times of the bars of the given timespan in
+    [start, end): weekdays only, regular trading hours for intraday bars,
+    and weeks starting on Sunday.
+    """
+    if timespan == "week":
+        day = datetime(start.year, start.month, start.day)
+        day += timedelta(days=(6 - day.weekday()) % 7)
+        while day < end:
+            if day >= start:
+                yield day
+            day += timedelta(days=7)
+        return
+
+    if timespan == "minute":
+        offsets = [timedelta(hours=9, minutes=30 + i) for i in range(390)]
+    elif timespan == "hour":
+        offsets = [timedelta(hours=9 + i) for i in range(7)]
+    else:
+        offsets = [timedelta(0)]
+
+    day = datetime(start.year, start.month, start.day)
+    while day < end:
+        if day.weekday() < 5:
+            for offset in offsets:
+                bar_time = day + offset
+                if start <= bar_time < end:
+                    yield bar_time
+        day += timedelta(days=1)
+
+
+class FakeBackend:
+    # Latency, error rate and call counts shared by both fake backends
+    def __init__(self, num_tickers=FAKE_BACKEND_TICKERS, latency=FAKE_BACKEND_LATENCY,
+                 error_rate=FAKE_BACKEND_ERROR_RATE, seed=FAKE_BACKEND_SEED):
+        self.num_tickers = num_tickers
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.tickers = fake_tickers(num_tickers)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.errors = {}
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+            self.errors = {}
+
+    def begin_call(self, endpoint, *key):
+        """
+        Counts the call, waits for the latency, and returns True if the call
+        must fail. The same endpoint and key always give the same answer.
+        """
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        failed = self.error_rate > 0 and unit_noise(stable_hash(self.seed, "error", endpoint, *key), 0) < self.error_rate
+        if failed:
+            with self.lock:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return failed
+
+
+class FakeRESTClient(FakeBackend):
+    """
+    Synthetic stand-in for polygon.RESTClient. Prices follow a slow sine
+    wave around a base price per ticker, with deterministic noise per bar.
+    """
+    def check(self, endpoint, *key):
+        if self.begin_call(endpoint, *key):
+            raise BadResponse(f'{{"status":"ERROR","error":"Synthetic {endpoint} error"}}')
+
+    def base_price(self, ticker):
+        return 10 + unit_noise(stable_hash(self.seed, "price", ticker), 0) * 490
+
+    def price(self, ticker_key, base_price, seconds):
+        trend = 1 + 0.15 * math.sin(seconds / (86400 * 90) + ticker_key % 628 / 100)
+        return base_price * trend * (1 + 0.02 * (unit_noise(ticker_key, int(seconds)) - 0.5))
+
+    def get_ticker_types(self, asset_class=None, locale=None, params=None, raw=False, options=None):
+        self.check("get_ticker_types", asset_class, locale)
+        return [
+            TickerTypes(asset_class="stocks", code=code, description=description, locale="us")
+            for code, description in FAKE_TICKER_TYPES.items()
+        ]
+
+    def ticker_type(self, ticker):
+        # Mostly common stocks, a few ETFs and ADRs
+        noise = unit_noise(stable_hash(self.seed, "type", ticker), 0)
+        return "CS" if noise < 0.85 else ("ETF" if noise < 0.95 else "ADRC")
+
+    def list_tickers(self, market=None, active=None, limit=10, sort="ticker", order="asc", **kwargs):
+        self.check("list_tickers", market, active)
+        for ticker in sorted(self.tickers):
+            yield Ticker(
+                active=True, market="stocks", locale="us", ticker=ticker, name=f"{ticker} Synthetic Inc.",
+                type=self.ticker_type(ticker), primary_exchange="XNAS" if len(ticker) > 3 else "XNYS",
+            )
+
+    def get_snapshot_all(self, market_type, tickers=None, params=None, raw=False, include_otc=False, options=None):
+        self.check("get_snapshot_all", market_type)
+        now = datetime.now(EASTERN_TZ)
+        seconds = int(now.timestamp())
+        snapshot = []
+        for ticker in self.tickers:
+            key = stable_hash(self.seed, "snapshot", ticker)
+            close = round(self.price(key, self.base_price(ticker), seconds), 2)
+            change_percent = (unit_noise(key, 1) - 0.5) * 20
+            change = round(close * change_percent / (100 + change_percent), 2)
+            snapshot.append(TickerSnapshot(
+                ticker=ticker,
+                day=Agg(
+                    open=round(close - change, 2), high=round(close * 1.01, 2), low=round(close * 0.99, 2),
+                    close=close, volume=int(1_000 + unit_noise(key, 2) * 50_000_000),
+                ),
+                todays_change=change,
+                todays_change_percent=change_percent,
+                updated=seconds * 1_000_000_000,
+            ))
+        return snapshot
+
+    def get_ticker_details(self, ticker=None, date=None, params=None, raw=False, options=None):
+        self.check("get_ticker_details", ticker, date)
+        key = stable_hash(self.seed, "details", ticker)
+        return TickerDetails(
+            ticker=ticker,
+            name=f"{ticker} Synthetic Inc.",
+            description=f"{ticker} Synthetic Inc. is a made up company used for offline runs.",
+            homepage_url=f"https://www.{ticker.lower()}.example.com",
+            list_date=(datetime(1980, 1, 1) + timedelta(days=int(unit_noise(key, 0) * 15_000))).strftime("%Y-%m-%d"),
+            branding=Branding(icon_url=None),
+            sic_description="SYNTHETIC INDUSTRY",
+            total_employees=int(10 + unit_noise(key, 1) * 100_000),
+            type=self.ticker_type(ticker),
+            market_cap=self.base_price(ticker) * (1e6 + unit_noise(key, 2) * 1e10),
+        )
+
+    def get_related_companies(self, ticker=None, params=None, raw=False, options=None):
+        self.check("get_related_companies", ticker)
+        i = self.ticker_index.get(ticker, 0)
+        return [RelatedCompany(ticker=self.tickers[(i + step) % self.num_tickers]) for step in (1, 2, 3)]
+
+    def aggs(self, ticker, timespan, from_, to):
+        start = to_naive_datetime(from_)
+        end = to_naive_datetime(to, end_of_day=True)
+        key = stable_hash(self.seed, "aggs", ticker, timespan)
+        base_price = self.base_price(ticker)
+        bars = []
+        utc_offsets = {}
+        for bar_time in bar_times(timespan, start, end):
+            day = bar_time.date()
+            if day not in utc_offsets:
+                # Offset of ET at noon, never on the hour of a DST change
+                utc_offsets[day] = EASTERN_TZ.localize(datetime(day.year, day.month, day.day, 12)).utcoffset()
+            seconds = int((bar_time - utc_offsets[day] - EPOCH).total_seconds())
+            close = self.price(key, base_price, seconds)
+            bars.append(Agg(
+                open=close * 0.998, high=close * 1.005, low=close * 0.995, close=close,
+                volume=int(100 + unit_noise(key, seconds + 1) * 1_000_000), timestamp=seconds * 1000,
+            ))
+        return bars
+
+    def list_aggs(self, ticker, multiplier, timespan, from_, to, adjusted=None, sort=None, limit=None,
+                  params=None, raw=False, options=None):
+        self.check("list_aggs", ticker, multiplier, timespan, from_, to)
+        bars = self.aggs(ticker, timespan, from_, to)
+        if sort == "desc":
+            bars = bars[::-1]
+        return iter(bars[:limit] if limit else bars)
+
+    def get_ema(self, ticker, timestamp_gte=None, timespan=None, window=None, limit=None, order=None, **kwargs):
+        self.check("get_ema", ticker, timestamp_gte, timespan, window)
+        bars = self.aggs(ticker, timespan, timestamp_gte, datetime.now(EASTERN_TZ))
+        alpha = 2 / (window + 1)
+        values = []
+        value = None
+        for bar in bars:
+            value = bar.close if value is None else alpha * bar.close + (1 - alpha) * value
+            values.append(IndicatorValue(timestamp=bar.timestamp, value=value))
+        values.reverse()
+        return SingleIndicatorResults(values=values[:limit] if limit else values)
+
+
+class FakeResponse:
+    def __init__(self, url, status_code, text):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class FakeScrapeSession(FakeBackend):
+    """
+    Synthetic stand-in for the requests.Session used to scrape slickcharts.
+    Serves index pages with the same table layout as the real website,
+    holding tickers of the FakeRESTClient universe with the same settings.
+    """
+    def get(self, url, timeout=None, **kwargs):
+        slug = (url or "").rstrip("/").rsplit("/", 1)[-1]
+        if self.begin_call("get", slug):
+            return FakeResponse(url, 503, "Service Unavailable")
+        return FakeResponse(url, 200, self.index_page(slug))
+
+    def index_page(self, slug):
+        universe = min(FAKE_INDEX_UNIVERSE, self.num_tickers)
+        size = min(FAKE_INDEX_SIZES.get(slug, 50), universe)
+        key = stable_hash(self.seed, "index", slug)
+        picks = sorted(range(universe), key=lambda i: unit_noise(key, i))[:size]
+        picks.sort()
+
+        # Larger tickers (lower index) get larger weights
+        raw_weights = [1 / (rank + 1) for rank in range(size)]
+        total = sum(raw_weights)
+        rows = []
+        for rank, i in enumerate(picks):
+            ticker = self.tickers[i]
+            rows.append(
+                f"<tr><td>{rank + 1}</td><td><a href=\"/symbol/{ticker}\">{ticker} Synthetic Inc.</a></td>"
+                f"<td><a href=\"/symbol/{ticker}\">{ticker}</a></td>"
+                f"<td>{raw_weights[rank] / total * 100:.2f}%</td></tr>"
+            )
+        return (
+            "<html><body><table class=\"table table-hover\"><thead><tr><th>#</th><th>Company</th>"
+            "<th>Symbol</th><th>Portfolio%</th></tr></thead><tbody>" + "".join(rows) +
+            "</tbody></table></body></html>"
+        )
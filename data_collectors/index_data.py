@@ -1,6 +1,8 @@
-import time
+import os
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from bs4 import BeautifulSoup
+from data_collectors.rate_limiter import HostLimiter
 
 # Define the indices and their URLs
 slick_charts_url = "https://www.slickcharts.com"
@@ -40,6 +42,30 @@ indices_info = {
 # List of all indices available in this script
 all_indices = list(indices_info.keys())
 
+# Politeness limits for scraping: max parallel requests to one host and
+# min seconds between the start of two requests to the same host
+SCRAPE_MAX_PER_HOST = 2
+SCRAPE_MIN_INTERVAL = 1.0
+
+headers = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
+    )
+}
+
+# "fake" serves synthetic index pages offline, see data_collectors/fake_backends.py
+SCRAPE_BACKEND = os.getenv("SCRAPE_BACKEND", "slickcharts")
+
+# Shared between all scraping threads to reuse connections to the host
+if SCRAPE_BACKEND == "fake":
+    from data_collectors.fake_backends import FakeScrapeSession
+    session = FakeScrapeSession()
+else:
+    session = requests.Session()
+    session.headers.update(headers)
+host_limiter = HostLimiter(SCRAPE_MAX_PER_HOST, SCRAPE_MIN_INTERVAL)
+
 def get_index_info(index):
     """
     Returns the information for the index given to the function using the
@@ -70,18 +96,13 @@ def fetch_index_data(index):
     # List of stock data dictionary for each stock in the index at the
     # given url
     index_holdings = []
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
-        )
-    }
-
-    # Getting response from the webpage at given url
+
+    # Getting response from the webpage at given url, waiting for our
+    # turn with the host instead of a fixed sleep after every request
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        with host_limiter.limit(url):
+            response = session.get(url, timeout=10)
         response.raise_for_status()
-        time.sleep(5)
     except requests.RequestException as e:
         print(f"[Request Error] Failed to fetch {url}: {e}")
         return index_holdings
@@ -112,3 +133,23 @@ def fetch_index_data(index):
     except Exception as e:
         print(f"[Parsing Error] {url}: {e}")
         return []
+
+def fetch_all_index_data(indices=None, max_workers=None):
+    """
+    Scrapes all the given indices at the same time, within the per-host
+    politeness limits, and yields the holdings of each index as soon as
+    it has been scraped, so the caller can start working on it without
+    waiting for the other indices.
+    :param indices: list of keys in indices_info dict, defaults to all_indices
+    :param max_workers: max number of indices scraped at once, defaults to
+        the number of indices
+    :return: generator of (index, index_holdings) tuples in completion order
+    """
+    indices = list(indices or all_indices)
+    if not indices:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(indices)) as executor:
+        futures = {executor.submit(fetch_index_data, index): index for index in indices}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
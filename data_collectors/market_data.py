@@ -12,7 +12,7 @@ def main():
 
     # Define file path
     BASE_DIR = Path(__file__).resolve().parent.parent
-    DATA_DIR = BASE_DIR / "data"
+    DATA_DIR = Path(os.getenv("DATA_DIR") or BASE_DIR / "data")
     DATA_FILE = DATA_DIR / "market_status.json"
 
     # Ensure folder exists
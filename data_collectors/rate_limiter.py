@@ -0,0 +1,106 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    Tokens are added at a steady 'rate' per second up to 'capacity', and
+    every call to acquire() takes one token, blocking until one is available.
+    A rate of 0 (or less) disables the limiter.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed = now - self.last_refill
+                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+
+            # Sleep outside the lock so other threads can refill/check too
+            time.sleep(wait_time)
+
+
+class RateLimitedClient:
+    """
+    Wraps a polygon RESTClient so that every HTTP request to the API first
+    takes a token from the shared TokenBucket. The paginated endpoints
+    (e.g. list_aggs) return lazy iterators that request the next pages
+    while they are consumed, so the token is taken in the client's _get,
+    which sends every request including those pages. Clients without _get
+    (e.g. the fake backend) take one token per method call instead.
+    Attributes that are not methods are passed through untouched.
+    """
+    def __init__(self, client, bucket):
+        self._client = client
+        self._bucket = bucket
+        self._per_request = callable(getattr(client, "_get", None))
+        if self._per_request:
+            get = client._get
+
+            @functools.wraps(get)
+            def rate_limited_get(*args, **kwargs):
+                bucket.acquire()
+                return get(*args, **kwargs)
+
+            # Set on the instance, so the client's own calls to self._get go through it
+            client._get = rate_limited_get
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or self._per_request:
+            return attr
+
+        @functools.wraps(attr)
+        def rate_limited_call(*args, **kwargs):
+            self._bucket.acquire()
+            return attr(*args, **kwargs)
+
+        return rate_limited_call
+
+
+class HostLimiter:
+    """
+    Politeness limits for scraping, tracked separately for every host:
+    at most 'max_concurrent' requests in flight to a host at once, and
+    at least 'min_interval' seconds between the start of two requests
+    to the same host.
+    """
+    def __init__(self, max_concurrent=2, min_interval=1.0):
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.semaphores = {}  # host -> Semaphore
+        self.next_start = {}  # host -> earliest monotonic time for the next request
+
+    @contextmanager
+    def limit(self, url):
+        host = urlparse(url or "").netloc
+        with self.lock:
+            semaphore = self.semaphores.setdefault(host, threading.Semaphore(self.max_concurrent))
+
+        with semaphore:
+            # Reserve the next start slot for this host, then wait for it
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start.get(host, now))
+                self.next_start[host] = start + self.min_interval
+            time.sleep(start - now)
+            yield
@@ -3,13 +3,39 @@ from polygon import RESTClient
 from dotenv import load_dotenv
 import os
 from models.database import Stock, StockMaster, StockMinute, StockHour, StockDay, StockWeek
-from utils.datetime_utils import polygon_timestamp_et, format_date, DATE_FORMAT, DATETIME_FORMAT
+from utils.datetime_utils import polygon_timestamp_et, format_date, to_naive_et, DATE_FORMAT, DATETIME_FORMAT
 from utils.populate_db_info import db_last_updated_date
+from data_collectors.rate_limiter import TokenBucket, RateLimitedClient
+from data_collectors.api_cache import MemoizedClient
+from utils.moving_averages import ema, sma_latest
+import math
 
 load_dotenv()
 
 POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
-client = RESTClient(POLYGON_API_KEY)
+# Max Polygon API calls per second allowed by our plan (0 = no limit),
+# and how many calls can burst above that rate at once
+POLYGON_RATE_LIMIT = float(os.getenv("POLYGON_RATE_LIMIT", "25"))
+POLYGON_RATE_BURST = int(os.getenv("POLYGON_RATE_BURST", "5"))
+# Max number of open connections kept to the Polygon API
+POLYGON_MAX_CONNECTIONS = int(os.getenv("POLYGON_MAX_CONNECTIONS", "16"))
+
+# "fake" serves synthetic data offline, see data_collectors/fake_backends.py
+POLYGON_BACKEND = os.getenv("POLYGON_BACKEND", "polygon")
+
+if POLYGON_BACKEND == "fake":
+    from data_collectors.fake_backends import FakeRESTClient
+    rest_client = FakeRESTClient()
+else:
+    rest_client = RESTClient(POLYGON_API_KEY)
+    # Keep one pooled connection per concurrent fetch instead of the default one
+    rest_client.client.connection_pool_kw["maxsize"] = POLYGON_MAX_CONNECTIONS
+# All the API calls made by this script share one rate limiter. During a
+# database population run (client.start_run() ... client.end_run()), the
+# responses are also memoized, so repeated calls never reach the API.
+client = MemoizedClient(
+    RateLimitedClient(rest_client, TokenBucket(POLYGON_RATE_LIMIT, POLYGON_RATE_BURST))
+)
 
 # List of all attributes that we store in the database for all stocks available in Polygon API.
 # Must be the same as all the fields in the Stock Master table in the database.
@@ -95,8 +121,39 @@ SELECT_DB_TABLE = {
 # Timeframes for which we store the chart data in the database
 DB_TIMEFRAMES = ["1D", "1W", "1Y", "5Y"]
 
+def get_parent_timeframe(timeframe):
+    """
+    Returns the DB timeframe whose bars cover the given timeframe: the
+    other timeframes are the end of the DB timeframe of the same timespan
+    (e.g. 3M of 1Y, 3Y of 5Y).
+    """
+    if timeframe in DB_TIMEFRAMES:
+        return timeframe
+    timespan = TIMEFRAME_OPTIONS[timeframe]["timespan"]
+    for db_timeframe in DB_TIMEFRAMES:
+        if TIMEFRAME_OPTIONS[db_timeframe]["timespan"] == timespan:
+            return db_timeframe
+    return timeframe
+
 DECIMAL_PRECISION = 2
 
+# Windows of the moving averages (DMAs and chart EMAs), in bars
+EMA_WINDOWS = [30, 50, 200]
+
+# Number of extra bars fetched before the start of a chart window so that
+# the locally computed EMAs are warmed up by the first bar of the window
+EMA_WARMUP_BARS = int(os.getenv("EMA_WARMUP_BARS", "500"))
+
+# Approximate number of bars per calendar day for each timespan, used to
+# turn EMA_WARMUP_BARS into a date range (regular trading hours only, so
+# the range errs on the long side)
+BARS_PER_DAY = {
+    "minute": 390,
+    "hour": 7,
+    "day": 5 / 7,
+    "week": 1 / 7,
+}
+
 def fetch_all_stocks_data():
     """
     For all the stocks available in polygon API, this function collects
@@ -176,6 +233,20 @@ def fetch_all_stocks_data():
     print(f"Retrieved {len(stock_master_data)} stocks from Polygon API!")
     return stock_master_data
 
+def start_api_cache():
+    # Memoize the API responses until end_api_cache is called
+    client.start_run()
+
+def end_api_cache():
+    """
+    Stops memoizing the API responses and prints how many calls were
+    served from the memoized responses (hits) or made to the API (misses).
+    """
+    stats = client.end_run()
+    for endpoint, counts in stats.items():
+        print(f"API cache {endpoint}: {counts['hits']} hits, {counts['misses']} misses")
+    return stats
+
 def get_ticker_type(ticker_type):
     try:
         types = client.get_ticker_types(asset_class="stocks", locale="us")
@@ -224,6 +295,9 @@ def get_ticker_details(stock_data, ticker, now):
 
 def get_365_day_data(ticker, now):
     before = datetime.strptime(now, DATE_FORMAT) - timedelta(days=365)
+    # Request the same bars as the 1Y chart (warm-up included) and keep the
+    # last 365 days, so that the memoized response serves both
+    fetch_from = get_chart_fetch_start("1Y", now)
     data = {
         "timestamp": None,
         "open": [],
@@ -233,17 +307,23 @@ def get_365_day_data(ticker, now):
         "volume": []
     }
 
+    day_aggs = [
+        day_data for day_data in client.list_aggs(
+            ticker=ticker,
+            multiplier=1,
+            timespan="day",
+            from_=format_date(fetch_from),
+            to=now,
+            adjusted=True,
+            sort="asc",
+            limit=50000,
+        )
+        if to_naive_et(polygon_timestamp_et(day_data.timestamp, "millisecond")) >= before
+    ]
+
+    # Latest day first
     first_iteration = True
-    for day_data in client.list_aggs(
-        ticker=ticker,
-        multiplier=1,
-        timespan="day",
-        from_=before,
-        to=now,
-        adjusted=True,
-        sort="desc",
-        limit=365,
-    ):
+    for day_data in reversed(day_aggs[-365:]):
         if first_iteration:
             data["timestamp"] = day_data.timestamp
             first_iteration = False
@@ -276,16 +356,10 @@ def get_ticker_values(stock_data, stock_365_day_data):
 def get_ticker_dmas(stock_data, stock_365_day_data):
     try:
         last_close = stock_365_day_data["close"][0]
-        closing_200_days = stock_365_day_data["close"][:200]
-        dma_200 = sum(closing_200_days) / len(closing_200_days)
+        # The 365 day closes are in descending order of date
+        dma_30, dma_50, dma_200 = sma_latest(stock_365_day_data["close"][::-1], EMA_WINDOWS)
         dma_200_perc_diff = (last_close - dma_200) / dma_200 * 100
 
-        closing_50_days = stock_365_day_data["close"][:50]
-        dma_50 = sum(closing_50_days) / len(closing_50_days)
-
-        closing_30_days = stock_365_day_data["close"][:30]
-        dma_30 = sum(closing_30_days) / len(closing_30_days)
-
         stock_data["dma_200"] = round(dma_200, DECIMAL_PRECISION)
         stock_data["dma_50"] = round(dma_50, DECIMAL_PRECISION)
         stock_data["dma_30"] = round(dma_30, DECIMAL_PRECISION)
@@ -335,94 +409,130 @@ def fetch_stock_data(ticker, now=None):
 
     return stock
 
-def fetch_chart_data(stock, timeframe, now=None):
+def get_timeframe_start(timeframe, now):
     """
-    Fetch chart data for a given stock object from Polygon API.
-    The `stock` argument should be a Stock ORM object.
+    Returns the start of the chart window of the given timeframe as a
+    naive datetime (midnight in ET) for the given date string.
     """
-    chart_data = []
-    if not stock or not isinstance(stock, Stock):
-        return chart_data
+    before = TIMEFRAME_OPTIONS[timeframe].get("before")(datetime.strptime(now, DATE_FORMAT))
+    return datetime.strptime(format_date(before), DATE_FORMAT)
+
+def get_ema_warmup(timespan):
+    # Calendar time covering EMA_WARMUP_BARS bars, plus a few days for holidays
+    return timedelta(days=math.ceil(EMA_WARMUP_BARS / BARS_PER_DAY[timespan]) + 4)
 
-    ticker = stock.ticker
+def get_chart_fetch_start(timeframe, now):
+    """
+    Returns the date from which the bars of a full chart window of the
+    given timeframe are fetched: the window start, minus the EMA warm-up
+    for timeframes with EMA data.
+    """
+    fetch_from = get_timeframe_start(timeframe, now)
+    timeframe_data = TIMEFRAME_OPTIONS[timeframe]
+    if timeframe_data.get("ema_data"):
+        fetch_from -= get_ema_warmup(timeframe_data.get("timespan"))
+    return fetch_from
+
+def get_chart_columns(timeframe):
+    """
+    Returns the names of the chart DB table columns, in the order of the
+    values in the rows returned by fetch_chart_rows for the timeframe.
+    """
+    columns = ["date", "close_price", "volume"]
+    if TIMEFRAME_OPTIONS[timeframe].get("ema_data"):
+        columns += ["ema_30", "ema_50", "ema_200"]
+    return columns
+
+def fetch_chart_rows(ticker, timeframe, now=None, since=None, ema_seed=None):
+    """
+    Fetch chart data for a given ticker from Polygon API as plain tuples,
+    with the values of the columns returned by get_chart_columns.
+    If `since` is given, only the bars from that date onward are fetched
+    instead of the full timeframe window (used for incremental population).
+    The EMAs are computed locally from the close prices. Extra bars before
+    the window are fetched to warm them up, unless `ema_seed` is given as
+    (date, [ema_30, ema_50, ema_200]) of a stored bar, in which case the
+    EMAs of the bars after that date continue from those values.
+    """
+    chart_rows = []
     if not now:
         now = db_last_updated_date()
 
     timeframe_data = TIMEFRAME_OPTIONS[timeframe]
     timespan = timeframe_data.get("timespan")
-    before = format_date(timeframe_data.get("before")(datetime.strptime(now, DATE_FORMAT)))
-    db_table = SELECT_DB_TABLE.get(timespan)
+    before = datetime.strptime(format_date(since or get_timeframe_start(timeframe, now)), DATE_FORMAT)
     ema_data = timeframe_data.get("ema_data")
 
-    common_dates = set()
-    close_price_data = {}
-    volume_data = {}
+    fetch_from = before
+    if ema_data and not ema_seed:
+        fetch_from = before - get_ema_warmup(timespan)
+
+    dates = []
+    close_prices = []
+    volumes = []
 
     # Price & volume
     for stock_data in client.list_aggs(
         ticker=ticker,
         multiplier=1,
         timespan=timespan,
-        from_=before,
+        from_=format_date(fetch_from),
         to=now,
         adjusted=True,
         sort="asc",
-        limit=1000,
+        limit=50000,
     ):
-        timestamp = stock_data.timestamp
-        common_dates.add(timestamp)
-        close_price_data[timestamp] = round(stock_data.close, DECIMAL_PRECISION)
-        volume_data[timestamp] = int(stock_data.volume)
-
-    # EMA helper
-    def get_ema_data(ema_window):
-        ema_data_ = {}
-        ema = client.get_ema(
-            ticker=ticker,
-            timestamp_gte=before,
-            timespan=timespan,
-            adjusted="true",
-            window=ema_window,
-            series_type="close",
-            order="asc",
-            limit="1000",
-        )
-        for value in ema.values:
-            timestamp_ = value.timestamp
-            ema_data_[timestamp_] = round(value.value, DECIMAL_PRECISION)
-        return ema_data_
-
-    # EMA calculations
-    ema_30_data = {}
-    ema_50_data = {}
-    ema_200_data = {}
-    if ema_data:
-        ema_30_data = get_ema_data("30")
-        ema_50_data = get_ema_data("50")
-        ema_200_data = get_ema_data("200")
-
-        common_dates &= set(ema_30_data) & set(ema_50_data) & set(ema_200_data)
+        dates.append(polygon_timestamp_et(stock_data.timestamp, "millisecond"))
+        close_prices.append(stock_data.close)
+        volumes.append(int(stock_data.volume))
+
+    # EMA calculations, in one pass for all the windows
+    ema_values = None
+    if ema_data and dates:
+        ema_values = [[None] * len(dates) for _ in EMA_WINDOWS]
+        start = 0
+        initial = None
+        if ema_seed:
+            seed_date, initial = ema_seed
+            while start < len(dates) and to_naive_et(dates[start]) <= seed_date:
+                start += 1
+
+        if start < len(dates):
+            computed = ema(close_prices[start:], EMA_WINDOWS, initial)
+            for row, window_values in enumerate(computed.tolist()):
+                ema_values[row][start:] = [
+                    None if math.isnan(value) else round(value, DECIMAL_PRECISION)
+                    for value in window_values
+                ]
+
+    # Build the rows for the bars inside the window
+    for i, et_date in enumerate(dates):
+        if to_naive_et(et_date) < before:
+            continue
+
+        row = (et_date, round(close_prices[i], DECIMAL_PRECISION), volumes[i])
+        if ema_data:
+            row += (ema_values[0][i], ema_values[1][i], ema_values[2][i])
+        chart_rows.append(row)
 
-    # Build ORM objects
-    for date in sorted(common_dates):
-        et_date = polygon_timestamp_et(date, "millisecond")
-        close_price = close_price_data[date]
-        volume = volume_data[date]
-
-        kwargs = dict(
-            stock=stock,
-            date=et_date,
-            close_price=close_price,
-            volume=volume
-        )
+    return chart_rows
 
-        if ema_data:
-            kwargs.update(
-                ema_30=ema_30_data[date],
-                ema_50=ema_50_data[date],
-                ema_200=ema_200_data[date]
-            )
+def fetch_chart_data(stock, timeframe, now=None, since=None, ema_seed=None):
+    """
+    Fetch chart data for a given stock object from Polygon API.
+    The `stock` argument should be a Stock ORM object.
+    Returns a list of chart DB model objects attached to the stock,
+    see fetch_chart_rows for the other arguments.
+    """
+    chart_data = []
+    if not stock or not isinstance(stock, Stock):
+        return chart_data
+
+    db_table = SELECT_DB_TABLE.get(TIMEFRAME_OPTIONS[timeframe].get("timespan"))
+    columns = get_chart_columns(timeframe)
 
-        chart_data.append(db_table(**kwargs))
+    # Build ORM objects
+    for row in fetch_chart_rows(stock.ticker, timeframe, now, since, ema_seed):
+        chart_data.append(db_table(stock=stock, **dict(zip(columns, row))))
 
     return chart_data
@@ -0,0 +1,109 @@
+import csv
+import io
+import os
+import sqlite3
+
+# Number of rows written per statement (or per COPY) by bulk_insert
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "5000"))
+
+# Max number of bound parameters in one SQLite statement
+SQLITE_MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+def model_columns(model, exclude=("id",)):
+    # Names of the columns of a DB model, in table order
+    return [column.name for column in model.__table__.columns if column.name not in exclude]
+
+def model_row(obj, columns):
+    # Values of the given columns of a DB model object as a plain tuple
+    return tuple(getattr(obj, column) for column in columns)
+
+def bulk_insert(connection, table, columns, rows, batch_size=BULK_BATCH_SIZE):
+    """
+    Inserts plain row tuples into a table with Core, bypassing the ORM
+    unit of work. Rows are written in batches of 'batch_size', using the
+    fastest path of the database: COPY on PostgreSQL, multi-row VALUES on
+    SQLite, and executemany of insert() everywhere else (which the MySQL
+    driver already rewrites into multi-row VALUES).
+    :param connection: SQLAlchemy Connection, e.g. db.session.connection()
+    :param table: Core Table to insert into, e.g. StockDay.__table__
+    :param columns: list of column names, in the order of the row values
+    :param rows: iterable of tuples
+    :param batch_size: number of rows written at once
+    :return: number of rows inserted
+    """
+    dialect_name = connection.dialect.name
+    if dialect_name == "postgresql":
+        write_batch = copy_batch
+    elif dialect_name == "sqlite":
+        write_batch = multi_values_batch
+    else:
+        write_batch = executemany_batch
+
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            total += write_batch(connection, table, columns, batch)
+            batch = []
+    if batch:
+        total += write_batch(connection, table, columns, batch)
+    return total
+
+def executemany_batch(connection, table, columns, batch):
+    connection.execute(table.insert(), [dict(zip(columns, row)) for row in batch])
+    return len(batch)
+
+def bind_processors(connection, table, columns):
+    # Converters from Python values to what the driver expects for each
+    # column, the same ones SQLAlchemy applies to bound parameters
+    dialect = connection.dialect
+    processors = []
+    for column in columns:
+        column_type = table.c[column].type.dialect_impl(dialect)
+        processors.append(column_type.bind_processor(dialect))
+    return processors
+
+def multi_values_batch(connection, table, columns, batch):
+    dialect = connection.dialect
+    processors = bind_processors(connection, table, columns)
+    column_list = ", ".join(dialect.identifier_preparer.quote(column) for column in columns)
+    row_placeholder = "(" + ", ".join("?" for _ in columns) + ")"
+    rows_per_statement = max(1, SQLITE_MAX_VARIABLES // len(columns))
+
+    for start in range(0, len(batch), rows_per_statement):
+        chunk = batch[start:start + rows_per_statement]
+        params = []
+        for row in chunk:
+            for processor, value in zip(processors, row):
+                params.append(processor(value) if processor else value)
+        statement = (
+            f"INSERT INTO {dialect.identifier_preparer.format_table(table)} ({column_list}) "
+            f"VALUES {', '.join(row_placeholder for _ in chunk)}"
+        )
+        connection.exec_driver_sql(statement, tuple(params))
+    return len(batch)
+
+def copy_batch(connection, table, columns, batch):
+    dialect = connection.dialect
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow(["\\N" if value is None else value for value in row])
+    buffer.seek(0)
+
+    column_list = ", ".join(dialect.identifier_preparer.quote(column) for column in columns)
+    statement = (
+        f"COPY {dialect.identifier_preparer.format_table(table)} ({column_list}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    )
+    driver_connection = connection.connection.driver_connection
+    with driver_connection.cursor() as cursor:
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2
+            cursor.copy_expert(statement, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+    return len(batch)
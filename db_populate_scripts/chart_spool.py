@@ -0,0 +1,104 @@
+import os
+import pickle
+import tempfile
+import threading
+
+# Max memory (in MB) used by the chart rows waiting to be written to the
+# database. 0 keeps all of them in memory until the end of the run, any
+# other value streams them to a temporary spool file in batches.
+POPULATE_MEMORY_LIMIT_MB = float(os.getenv("POPULATE_MEMORY_LIMIT_MB", "0"))
+
+# Number of chart rows written to the spool file (and read back) at once
+POPULATE_BATCH_ROWS = int(os.getenv("POPULATE_BATCH_ROWS", "5000"))
+
+# Rough size of one chart row tuple (datetime, floats and ints) in memory
+CHART_ROW_BYTES = 400
+
+class ChartSpool:
+    """
+    Disk-backed staging area for chart rows, so that the memory used by a
+    population run does not grow with the number of tickers times bars.
+    Rows are added per ticker from any thread, buffered per timeframe, and
+    written to a temporary file as pickled batches of 'batch_rows' rows as
+    soon as a batch is full, or all at once when the buffered rows would go
+    above 'memory_limit_mb'. batches() reads them back one batch at a time.
+    """
+    def __init__(self, memory_limit_mb=POPULATE_MEMORY_LIMIT_MB, batch_rows=POPULATE_BATCH_ROWS, directory=None):
+        self.batch_rows = max(1, batch_rows)
+        self.max_buffered_rows = max(self.batch_rows, int(memory_limit_mb * 1024 * 1024 / CHART_ROW_BYTES))
+        self.file = tempfile.TemporaryFile(prefix="chart_spool_", dir=directory)
+        self.lock = threading.Lock()
+        self.buffers = {}  # timeframe -> list of (ticker, rows)
+        self.buffer_sizes = {}  # timeframe -> number of buffered rows
+        self.buffered_rows = 0
+        self.num_rows = 0
+
+    def add(self, timeframe, ticker, rows):
+        """
+        Stages the chart rows of one ticker for the given timeframe.
+        :param timeframe: one of the DB_TIMEFRAMES
+        :param ticker: ticker symbol the rows belong to
+        :param rows: list of chart row tuples
+        """
+        if not rows:
+            return
+        with self.lock:
+            start = 0
+            while start < len(rows):
+                # Fill the current batch of the timeframe up to batch_rows
+                room = self.batch_rows - self.buffer_sizes.get(timeframe, 0)
+                chunk = rows[start:start + room]
+                start += len(chunk)
+                self.buffers.setdefault(timeframe, []).append((ticker, chunk))
+                self.buffer_sizes[timeframe] = self.buffer_sizes.get(timeframe, 0) + len(chunk)
+                self.buffered_rows += len(chunk)
+                self.num_rows += len(chunk)
+                if self.buffer_sizes[timeframe] >= self.batch_rows:
+                    self.write_batch(timeframe)
+
+            if self.buffered_rows > self.max_buffered_rows:
+                for buffered_timeframe in list(self.buffers):
+                    self.write_batch(buffered_timeframe)
+
+    def write_batch(self, timeframe):
+        # Called with the lock held
+        batch = self.buffers.pop(timeframe, None)
+        if batch:
+            pickle.dump((timeframe, batch), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.buffered_rows -= self.buffer_sizes.pop(timeframe)
+
+    def batches(self):
+        """
+        Yields all the staged rows, one batch at a time, as (timeframe,
+        [(ticker, rows), ...]) tuples. Rows must not be added meanwhile.
+        """
+        with self.lock:
+            for timeframe in list(self.buffers):
+                self.write_batch(timeframe)
+            self.file.flush()
+            self.file.seek(0)
+
+        while True:
+            try:
+                yield pickle.load(self.file)
+            except EOFError:
+                break
+
+    def reset(self):
+        # Drops all the staged rows, to stage the next ones
+        with self.lock:
+            self.buffers.clear()
+            self.buffer_sizes.clear()
+            self.buffered_rows = 0
+            self.num_rows = 0
+            self.file.seek(0)
+            self.file.truncate()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,117 @@
+import os
+import pickle
+import queue
+import shutil
+import threading
+from models.database import Stock
+from db_populate_scripts.bulk_writer import model_columns, model_row
+from utils.populate_db_info import get_data_dir
+
+# Save the fetched data of every ticker during a population run, so that
+# a failed run can be resumed with --resume ("0" to turn it off)
+POPULATE_CHECKPOINTS = os.getenv("POPULATE_CHECKPOINTS", "1") == "1"
+
+# Max number of checkpoints waiting for the writer thread, the fetch
+# workers wait when it falls behind so their chart rows are not piled up
+CHECKPOINT_QUEUE_SIZE = 16
+
+def get_runs_dir():
+    return get_data_dir() / "runs"
+
+class RunCheckpoints:
+    """
+    Per-ticker checkpoints of the data fetched in a population run, stored
+    as one pickle file per ticker in data/runs/<run date>/tickers/.
+    A checkpoint holds the Stock values, the chart rows and rebuild flags of
+    each timeframe, and the latest stored bars the chart rows were fetched
+    after, so it is only reused while those are still the latest stored
+    bars (i.e. when the failed run did not write that ticker).
+    The files are written by a background thread, so the fetch workers
+    never wait on the disk; close() waits for the pending ones.
+    """
+    def __init__(self, run_date, resume=False):
+        self.run_dir = get_runs_dir() / run_date
+        self.tickers_dir = self.run_dir / "tickers"
+        self.resume = resume
+        self.num_resumed = 0
+        self.lock = threading.Lock()
+        self.stock_columns = model_columns(Stock)
+
+        if not resume:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+        self.tickers_dir.mkdir(parents=True, exist_ok=True)
+
+        self.pending = queue.Queue(maxsize=CHECKPOINT_QUEUE_SIZE)
+        self.writer = threading.Thread(target=self.write_pending, name="checkpoint-writer", daemon=True)
+        self.writer.start()
+
+    def get_path(self, ticker):
+        return self.tickers_dir / f"{ticker.upper().replace('/', '_')}.pkl"
+
+    def save(self, ticker, stock, chart_data, latest_bars):
+        """
+        Queues the checkpoint of the ticker for the writer thread.
+        :param ticker: ticker symbol
+        :param stock: fetched Stock ORM object
+        :param chart_data: dict of timeframe -> (chart rows, rebuild)
+        :param latest_bars: dict of timeframe -> latest stored bar the chart
+            rows were fetched after (see stock_fetcher.fetch_chart_update)
+        """
+        payload = {
+            "stock": model_row(stock, self.stock_columns),
+            # Copied, the caller may replace the rows once they are spooled
+            "chart_data": dict(chart_data),
+            "latest_bars": latest_bars,
+        }
+        self.pending.put((ticker, payload))
+
+    def write_pending(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            ticker, payload = item
+            path = self.get_path(ticker)
+            temp_path = path.with_suffix(".tmp")
+            try:
+                with open(temp_path, "wb") as f:
+                    pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+                # Never leave a half written checkpoint behind
+                os.replace(temp_path, path)
+            except OSError as e:
+                print(f"[Checkpoint Error] {ticker}: {e}")
+
+    def close(self):
+        # Waits for the queued checkpoints to be written
+        if self.writer.is_alive():
+            self.pending.put(None)
+            self.writer.join()
+
+    def load(self, ticker, latest_bars):
+        """
+        Returns the checkpointed (stock, chart_data) of the ticker when
+        resuming, or None if there is no usable checkpoint for it.
+        """
+        if not self.resume:
+            return None
+        path = self.get_path(ticker)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "rb") as f:
+                payload = pickle.load(f)
+        except Exception as e:
+            print(f"[Checkpoint Error] {ticker}: {e}")
+            return None
+        if payload["latest_bars"] != latest_bars:
+            return None
+
+        with self.lock:
+            self.num_resumed += 1
+        stock = Stock(**dict(zip(self.stock_columns, payload["stock"])))
+        return stock, payload["chart_data"]
+
+    def finish(self):
+        # The run succeeded, its checkpoints (and the ones of older runs) are not needed anymore
+        self.close()
+        shutil.rmtree(get_runs_dir(), ignore_errors=True)
@@ -19,160 +19,389 @@ elif IS_RELEASE == "0":
         os.makedirs(db_dir, exist_ok=True)
 
 from app import app
-from sqlalchemy import delete
-from models.database import db, Stock, Index, IndexHolding, StockMaster, StockMinute, StockHour, StockDay, StockWeek
-from data_collectors.index_data import all_indices, get_index_info, fetch_index_data
-from data_collectors.stock_data import fetch_all_stocks_data, fetch_stock_data, fetch_chart_data, DB_TIMEFRAMES
-from utils.datetime_utils import get_current_et, format_et_datetime, format_date
-from utils.db_queries.all_stocks import get_top_stocks
-from pathlib import Path
+from sqlalchemy import delete, update, select, func, and_
+from models.database import db, Stock, Index, IndexHolding, StockMaster, StockMinute, StockHour, StockDay, StockWeek, \
+    create_missing_indexes
+from data_collectors.index_data import all_indices, get_index_info, fetch_all_index_data
+from data_collectors.stock_data import fetch_all_stocks_data, get_timeframe_start, get_chart_columns, DB_TIMEFRAMES, \
+    TIMEFRAME_OPTIONS, SELECT_DB_TABLE, start_api_cache, end_api_cache
+from db_populate_scripts.stock_fetcher import StockFetcher
+from db_populate_scripts.bulk_writer import bulk_insert, model_columns, model_row
+from db_populate_scripts.checkpoints import RunCheckpoints, POPULATE_CHECKPOINTS
+from db_populate_scripts.chart_spool import ChartSpool, POPULATE_MEMORY_LIMIT_MB
+from db_populate_scripts.staging import staged_app, use_staging_file, POPULATE_STAGING, STAGING_CHOICES
+from utils.datetime_utils import get_current_et, format_et_datetime, format_date, to_naive_et
+from utils.populate_db_info import get_data_dir, load_populate_db_info
+import argparse
+import itertools
+from utils.db_queries.all_stocks import get_top_stocks, serialize_top_stocks, TOP_STOCKS_SNAPSHOT_FILE
+from utils.chart_store import build_chart_store, remove_old_chart_stores
 import json
 
 # -------- Stage all new data --------
 stocks_cache = {}  # ticker -> Stock object
-new_stock_master = []
+new_stock_master = []  # StockMaster row tuples
 new_indices = []
-new_index_holdings = []
+new_index_holdings = []  # (Index object, ticker, weight)
 new_stocks = []
+# timeframe -> list of (ticker, chart row tuples)
 new_chart_data = {timeframe: [] for timeframe in DB_TIMEFRAMES}
+# timeframe -> tickers whose stored chart rows are replaced instead of appended to
+chart_rebuilds = {timeframe: set() for timeframe in DB_TIMEFRAMES}
 
 # ---- Helper to get Stock object (with chart data) ----
-def get_or_fetch_stock(ticker, now_date):
+def get_or_fetch_stock(ticker, fetcher):
     ticker_upper = ticker.upper()
     if ticker_upper in stocks_cache:
         return stocks_cache[ticker_upper]
 
-    try:
-        stock = fetch_stock_data(ticker, now_date)
-        if stock:
-            stocks_cache[ticker_upper] = stock
-            new_stocks.append(stock)
-
-            # Attach chart data via relationship
-            for timeframe, data_list in new_chart_data.items():
-                chart_records = fetch_chart_data(stock, timeframe, now_date)
-                data_list.extend(chart_records)
-        return stock
-    except Exception as e:
-        print(f"[Fetch Error] {ticker}: {e}")
-        return None
+    # Waits for the concurrent fetch of this ticker to finish. Results are
+    # staged in the order they are asked for here, not in completion order.
+    stock, chart_data = fetcher.result(ticker)
+    if stock:
+        stocks_cache[ticker_upper] = stock
+        new_stocks.append(stock)
+
+        for timeframe, data_list in new_chart_data.items():
+            chart_rows, rebuild = chart_data.get(timeframe, ([], True))
+            data_list.append((stock.ticker.upper(), chart_rows))
+            if rebuild:
+                chart_rebuilds[timeframe].add(stock.ticker.upper())
+    return stock
+
+# ---- Helpers for incremental population ----
+def get_chart_table(timeframe):
+    return SELECT_DB_TABLE.get(TIMEFRAME_OPTIONS[timeframe]["timespan"])
+
+def load_latest_bars():
+    """
+    Reads the latest stored chart bar of every stock for each of the
+    DB_TIMEFRAMES, so that only the bars after it need to be fetched.
+    :return: dict of timeframe -> {ticker: {"date", "close_price", "emas"}}
+    """
+    latest_bars = {}
+    for timeframe in DB_TIMEFRAMES:
+        db_table = get_chart_table(timeframe)
+        ema_data = TIMEFRAME_OPTIONS[timeframe].get("ema_data")
+        ema_columns = [db_table.ema_30, db_table.ema_50, db_table.ema_200] if ema_data else []
 
-def populate_db():
+        latest_dates = select(
+            db_table.stock_id,
+            func.max(db_table.date).label("date")
+        ).group_by(db_table.stock_id).subquery()
+
+        rows = db.session.execute(
+            select(Stock.ticker, db_table.date, db_table.close_price, *ema_columns)
+            .join(db_table, db_table.stock_id == Stock.id)
+            .join(latest_dates, and_(
+                latest_dates.c.stock_id == db_table.stock_id,
+                latest_dates.c.date == db_table.date
+            ))
+        ).all()
+        latest_bars[timeframe] = {
+            row[0].upper(): {
+                "date": to_naive_et(row[1]),
+                "close_price": row[2],
+                "emas": list(row[3:]) if ema_data else None,
+            }
+            for row in rows
+        }
+    # End the read transaction before the write transaction begins
+    db.session.close()
+    return latest_bars
+
+def write_staged_stocks(now_date, spool=None):
+    """
+    Writes the staged stocks and their chart data in the current transaction.
+    Stocks already in the database are updated in place and keep their id,
+    new chart bars are appended to the stored ones (or replace them for the
+    tickers in chart_rebuilds), and bars that fell out of the timeframe
+    window are trimmed.
+    :param spool: ChartSpool holding the chart rows of the staged stocks,
+        streamed to the database one batch at a time and then emptied
+    :return: dict of ticker -> stock id for all the staged stocks
+    """
+    existing_ids = {
+        ticker.upper(): stock_id
+        for ticker, stock_id in db.session.execute(select(Stock.ticker, Stock.id)).all()
+    }
+
+    stock_ids = {}
+    stock_updates = []
+    fresh_stocks = {}
+    stock_columns = model_columns(Stock)
+    for stock in new_stocks:
+        ticker_upper = stock.ticker.upper()
+        values = dict(zip(stock_columns, model_row(stock, stock_columns)))
+        if ticker_upper in existing_ids:
+            stock_ids[ticker_upper] = existing_ids[ticker_upper]
+            stock_updates.append({"id": existing_ids[ticker_upper], **values})
+        else:
+            fresh_stocks[ticker_upper] = stock
+
+    if stock_updates:
+        db.session.execute(update(Stock), stock_updates)
+    db.session.add_all(fresh_stocks.values())
+    db.session.flush()
+    stock_ids.update({ticker: stock.id for ticker, stock in fresh_stocks.items()})
+
+    for timeframe in DB_TIMEFRAMES:
+        db_table = get_chart_table(timeframe)
+        rebuild_ids = [
+            existing_ids[ticker] for ticker in chart_rebuilds[timeframe] if ticker in existing_ids
+        ]
+        if rebuild_ids:
+            db.session.execute(delete(db_table).where(db_table.stock_id.in_(rebuild_ids)))
+
+    connection = db.session.connection()
+    staged_rows = list(new_chart_data.items())
+    if spool is not None:
+        staged_rows = itertools.chain(staged_rows, spool.batches())
+    for timeframe, ticker_rows in staged_rows:
+        rows = (
+            (stock_ids[ticker], *row)
+            for ticker, chart_rows in ticker_rows
+            for row in chart_rows
+        )
+        bulk_insert(
+            connection, get_chart_table(timeframe).__table__, ["stock_id", *get_chart_columns(timeframe)], rows
+        )
+    if spool is not None:
+        spool.reset()
+
+    # Trim the bars that are now outside the timeframe window
+    for timeframe in DB_TIMEFRAMES:
+        db_table = get_chart_table(timeframe)
+        window_start = get_timeframe_start(timeframe, now_date)
+        db.session.execute(delete(db_table).where(db_table.date < window_start))
+
+    return stock_ids
+
+def delete_stale_stocks():
+    # Delete the stocks (and their chart data) that were not refreshed in this run
+    refreshed_tickers = {stock.ticker.upper() for stock in stocks_cache.values()}
+    stale_ids = [
+        stock_id for ticker, stock_id in db.session.execute(select(Stock.ticker, Stock.id)).all()
+        if ticker.upper() not in refreshed_tickers
+    ]
+    if stale_ids:
+        for timeframe in DB_TIMEFRAMES:
+            db_table = get_chart_table(timeframe)
+            db.session.execute(delete(db_table).where(db_table.stock_id.in_(stale_ids)))
+        db.session.execute(delete(Stock).where(Stock.id.in_(stale_ids)))
+    print(f"Deleted {len(stale_ids)} stale stocks.")
+
+def clear_staged_stocks():
+    new_stocks.clear()
+    for timeframe in DB_TIMEFRAMES:
+        new_chart_data[timeframe].clear()
+        chart_rebuilds[timeframe].clear()
+
+def clear_staged_data():
+    # Staging is module level, start every run (in the same process) empty
+    stocks_cache.clear()
+    new_stock_master.clear()
+    new_indices.clear()
+    new_index_holdings.clear()
+    clear_staged_stocks()
+
+def populate_db(full_rebuild=False, staging=POPULATE_STAGING, memory_limit_mb=POPULATE_MEMORY_LIMIT_MB,
+                resume=False, checkpoints=POPULATE_CHECKPOINTS):
     """
     Populate the database by staging all data first, then replacing
     the main tables in a single atomic transaction.
     After the database is updated, compute Top Stocks and store them as well.
+    Tickers are fetched concurrently by a StockFetcher, sharing one rate
+    limiter for all the Polygon API calls. Their responses are memoized for
+    the length of the run, so repeated calls are only made once.
+    Chart data is populated incrementally: only the bars after the latest
+    stored bar are fetched and appended, unless a gap is detected for a
+    stock or full_rebuild is True, in which case it is fetched again.
+    For SQLite, all of this is written into a staging copy of the database
+    file that replaces the live one at the end (see staging.staged_app), so
+    the web app keeps reading the old data meanwhile.
+    :param full_rebuild: Delete and re-fetch all the chart data
+    :param staging: one of staging.STAGING_CHOICES
+    :param memory_limit_mb: if not 0, stream the fetched chart rows through
+        a ChartSpool that keeps at most this much of them in memory, instead
+        of keeping all of them in memory until they are written
+    :param resume: reuse the tickers checkpointed by a failed run of today
+        instead of fetching them again
+    :param checkpoints: checkpoint every fetched ticker (see RunCheckpoints)
     """
-    with app.app_context():
+    now = get_current_et()
+    now_date = format_date(now)
+
+    live_path = use_staging_file(app, staging)
+    with staged_app(app, live_path, copy_live=not full_rebuild) as target_app, target_app.app_context():
         print("Starting Database Population...\n")
-        now = get_current_et()
-        now_date = format_date(now)
 
         db.create_all()
+        for index_name in create_missing_indexes():
+            print(f"Created missing index: {index_name}")
 
-        # ---- Stock Master ----
-        stocks = fetch_all_stocks_data()
-        seen_tickers = set()
-        for stock in stocks:
-            ticker_upper = stock.ticker.upper()
-            if ticker_upper not in seen_tickers:
-                seen_tickers.add(ticker_upper)
-                new_stock_master.append(stock)
-            else:
-                print(f"Duplicate ticker skipped: {stock.ticker}.")
-
-        print(f"Skipped {len(stocks) - len(new_stock_master)} duplicate tickers.")
-        print(f"Total of {len(new_stock_master)} stocks fetched from polygon API!")
-
-        # ---- Indices and holdings ----
-        print(f"Fetching data for indices...")
-        for index in all_indices:
-            index_info = get_index_info(index)
-            index_obj = Index(
-                name=index_info.get("name"),
-                slug=index_info.get("slug"),
-                url=index_info.get("url"),
-                last_updated=now
-            )
-            new_indices.append(index_obj)
+        latest_bars = {}
+        if not full_rebuild:
+            latest_bars = load_latest_bars()
+            print(f"Loaded latest chart data for {len(latest_bars[DB_TIMEFRAMES[0]])} stocks.")
 
-            holdings = fetch_index_data(index)
-            for holding in holdings:
-                ticker = holding.get("ticker")
-                if ticker:
-                    stock = get_or_fetch_stock(ticker, now_date)
-                    if stock:
-                        index_holding = IndexHolding(
-                            index=index_obj,
-                            stock=stock,
-                            weight=holding.get("weight"),
-                        )
-                        new_index_holdings.append(index_holding)
-            print(f"Fetched data for: {index}!")
-        print(f"Fetched data for indices!")
-
-        # -------- Transactional Replace --------
+        clear_staged_data()
+        start_api_cache()
+        spool = ChartSpool(memory_limit_mb) if memory_limit_mb > 0 else None
+        run_checkpoints = RunCheckpoints(now_date, resume) if checkpoints or resume else None
         try:
-            print("\nUpdating the database with the new fetched data...")
-            with db.session.begin():
-                # Delete in FK-safe order
-                db.session.execute(delete(IndexHolding))
-                db.session.execute(delete(Index))
+            with StockFetcher(now_date, latest_bars, spool=spool, checkpoints=run_checkpoints) as fetcher:
+                stage_and_replace(now, now_date, fetcher, full_rebuild)
+                if not live_path:
+                    save_populate_db_info(now)
+                store_top_stocks(now_date, fetcher)
+
+            # Top movers of the final data, served from memory by /stocks
+            top_stocks = serialize_top_stocks(get_top_stocks())
+            # Chart data of the final data, served from packed arrays by /chart-data
+            chart_store = build_chart_store(now)
+            if not live_path:
+                save_top_stocks_snapshot(top_stocks)
+                # New generation for the top stocks and charts written after the first save
+                save_populate_db_info(now, chart_store)
+        finally:
+            if spool is not None:
+                spool.close()
+            # Also when the run fails, so it can be resumed from every ticker fetched
+            if run_checkpoints:
+                run_checkpoints.close()
+            end_api_cache()
+            clear_staged_data()
+
+        db.session.close()
+
+    if live_path:
+        # The new data is only live once the staging file is swapped in
+        save_populate_db_info(now, chart_store)
+        save_top_stocks_snapshot(top_stocks)
+    remove_old_chart_stores(keep=chart_store)
+    if run_checkpoints:
+        if resume:
+            print(f"Resumed {run_checkpoints.num_resumed} tickers from checkpoints.")
+        run_checkpoints.finish()
+    print("\nDatabase Population Completed!")
+
+def stage_and_replace(now, now_date, fetcher, full_rebuild):
+    # ---- Stock Master ----
+    stocks = fetch_all_stocks_data()
+    num_stocks = len(stocks)
+    seen_tickers = set()
+    # Staged as plain row tuples, much smaller than the ORM objects
+    stock_master_columns = model_columns(StockMaster)
+    for stock in stocks:
+        ticker_upper = stock.ticker.upper()
+        if ticker_upper not in seen_tickers:
+            seen_tickers.add(ticker_upper)
+            new_stock_master.append(model_row(stock, stock_master_columns))
+        else:
+            print(f"Duplicate ticker skipped: {stock.ticker}.")
+    del stocks
+
+    print(f"Skipped {num_stocks - len(new_stock_master)} duplicate tickers.")
+    print(f"Total of {len(new_stock_master)} stocks fetched from polygon API!")
+
+    # ---- Indices and holdings ----
+    print(f"Fetching data for indices...")
+    # All indices are scraped at once, and the holdings of each index are
+    # queued for concurrent fetching as soon as that index is scraped
+    all_holdings = {}
+    for index, holdings in fetch_all_index_data(all_indices):
+        all_holdings[index] = holdings
+        for holding in holdings:
+            ticker = holding.get("ticker")
+            if ticker:
+                fetcher.submit(ticker)
+
+    for index in all_indices:
+        index_info = get_index_info(index)
+        index_obj = Index(
+            name=index_info.get("name"),
+            slug=index_info.get("slug"),
+            url=index_info.get("url"),
+            last_updated=now
+        )
+        new_indices.append(index_obj)
+
+        for holding in all_holdings[index]:
+            ticker = holding.get("ticker")
+            if ticker:
+                stock = get_or_fetch_stock(ticker, fetcher)
+                if stock:
+                    new_index_holdings.append((index_obj, stock.ticker.upper(), holding.get("weight")))
+        print(f"Fetched data for: {index}!")
+    print(f"Fetched data for indices!")
+
+    # -------- Transactional Replace --------
+    try:
+        print("\nUpdating the database with the new fetched data...")
+        with db.session.begin():
+            # Delete in FK-safe order
+            db.session.execute(delete(IndexHolding))
+            db.session.execute(delete(Index))
+            if full_rebuild:
                 db.session.execute(delete(StockMinute))
                 db.session.execute(delete(StockHour))
                 db.session.execute(delete(StockDay))
                 db.session.execute(delete(StockWeek))
                 db.session.execute(delete(Stock))
-                db.session.execute(delete(StockMaster))
-
-                # Insert new data
-                db.session.add_all(new_stock_master)
-                db.session.add_all(new_indices)
-                db.session.add_all(new_stocks)
-                for value in new_chart_data.values():
-                    db.session.add_all(value)
-                db.session.add_all(new_index_holdings)
-            db.session.commit()
-
-            save_populate_db_info(now)
-            print("Updated the database with the new fetched data!\n")
-        except Exception as e:
-            print(f"Error: {e}")
-            db.session.rollback()
-            raise
-
-        print("Fetching Top Stocks data for updated database...")
-        top_stocks = get_top_stocks()
-
-        # Clearing the collected data to collect data for top stocks
-        new_stocks.clear()
-        for data_list in new_chart_data.values():
-            data_list.clear()
-
-        for top_stocks_category in top_stocks.values():
-            for category_stocks in top_stocks_category.get("category").values():
-                for stock in category_stocks:
-                    ticker = stock.ticker
-                    if ticker:
-                        get_or_fetch_stock(ticker, now_date)
-        print("Fetched Top Stocks data for updated database!")
-
-        # Insert Top Stocks and their chart data
-        print("Storing Top Stocks data in the database...")
-        if new_stocks or any(new_chart_data.values()):
-            db.session.add_all(new_stocks)
-            for value in new_chart_data.values():
-                db.session.add_all(value)
-            db.session.commit()
-        print("Stored Top Stocks data in the database!")
+            db.session.execute(delete(StockMaster))
 
-        db.session.close()
-        print("\nDatabase Population Completed!")
+            # Insert new data
+            bulk_insert(db.session.connection(), StockMaster.__table__, stock_master_columns, new_stock_master)
+            db.session.add_all(new_indices)
+            stock_ids = write_staged_stocks(now_date, fetcher.spool)
+            db.session.add_all([
+                IndexHolding(index=index_obj, stock_id=stock_ids[ticker], weight=weight)
+                for index_obj, ticker, weight in new_index_holdings
+            ])
+        db.session.commit()
+        print("Updated the database with the new fetched data!\n")
+    except Exception as e:
+        print(f"Error: {e}")
+        db.session.rollback()
+        raise
+
+def store_top_stocks(now_date, fetcher):
+    print("Fetching Top Stocks data for updated database...")
+    top_stocks = get_top_stocks()
 
-def save_populate_db_info(now):
+    # Clearing the collected data to collect data for top stocks
+    clear_staged_stocks()
+
+    top_tickers = []
+    for top_stocks_category in top_stocks.values():
+        for category_stocks in top_stocks_category.get("category").values():
+            for stock in category_stocks:
+                ticker = stock.ticker
+                if ticker:
+                    top_tickers.append(ticker)
+                    fetcher.submit(ticker)
+
+    for ticker in top_tickers:
+        get_or_fetch_stock(ticker, fetcher)
+    print("Fetched Top Stocks data for updated database!")
+
+    # Insert Top Stocks and their chart data, and remove the stocks
+    # from the previous run that are neither held nor top stocks anymore
+    print("Storing Top Stocks data in the database...")
+    try:
+        write_staged_stocks(now_date, fetcher.spool)
+        delete_stale_stocks()
+        db.session.commit()
+    except Exception as e:
+        print(f"Error: {e}")
+        db.session.rollback()
+        raise
+    print("Stored Top Stocks data in the database!")
+
+def save_populate_db_info(now, chart_store=None):
     # Define file path
-    base_dir = Path(__file__).resolve().parent.parent
-    data_dir = base_dir / "data"
+    data_dir = get_data_dir()
     data_file = data_dir / "populate_db_info.json"
 
     # Ensure folder exists
@@ -183,19 +412,57 @@ def save_populate_db_info(now):
     # Set current date
     date = format_date(now)
 
+    # Every save is a new generation of the data, the app drops what it
+    # cached from the previous one (see utils.query_cache)
+    generation = load_populate_db_info().get("generation", 0) + 1
+
     # Prepare data
     populate_db_info = {
         "last_updated": timestamp,
-        "last_updated_date": date
+        "last_updated_date": date,
+        "generation": generation,
+        "chart_store": chart_store
     }
 
-    # Save to JSON
-    with open(data_file, "w") as f:
+    # Save to JSON, through a temporary file so the app never reads a partial one
+    temp_file = data_file.with_suffix(".tmp")
+    with open(temp_file, "w") as f:
         json.dump(populate_db_info, f, indent=2)
+    os.replace(temp_file, data_file)
+
+def save_top_stocks_snapshot(top_stocks):
+    data_dir = get_data_dir()
+    data_dir.mkdir(parents=True, exist_ok=True)
+    data_file = data_dir / TOP_STOCKS_SNAPSHOT_FILE
+
+    # Write a temporary file and rename it, so the app never reads a partial one
+    temp_file = data_file.with_suffix(".tmp")
+    with open(temp_file, "w") as f:
+        json.dump(top_stocks, f, default=str)
+    os.replace(temp_file, data_file)
 
 def main():
+    parser = argparse.ArgumentParser(description="Populate the database with the latest stock data.")
+    parser.add_argument(
+        "--full", action="store_true",
+        help="Delete and re-fetch all the chart data instead of only fetching the new bars"
+    )
+    parser.add_argument(
+        "--staging", choices=STAGING_CHOICES, default=POPULATE_STAGING,
+        help="Write into a staging copy of the SQLite database file that is swapped in at the end ('auto': SQLite only)"
+    )
+    parser.add_argument(
+        "--memory-limit", type=float, default=POPULATE_MEMORY_LIMIT_MB, metavar="MB",
+        help="Stream the fetched chart rows to a spool file, keeping at most this much in memory (0 = off)"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Continue a failed run of today: reuse the tickers it already fetched instead of fetching them again"
+    )
+    args = parser.parse_args()
+
     # Load market status
-    data_path = Path(__file__).resolve().parent.parent / "data" / "market_status.json"
+    data_path = get_data_dir() / "market_status.json"
 
     if data_path.exists():
         with open(data_path) as f:
@@ -205,7 +472,9 @@ def main():
             print(f"Market status was {market_status} - skipping DB population!")
         else:
             print(f"Market status was {market_status} - proceeding with DB population...")
-            populate_db()
+            populate_db(
+                full_rebuild=args.full, staging=args.staging, memory_limit_mb=args.memory_limit, resume=args.resume
+            )
     else:
         print("Market status file missing - cannot determine whether to proceed with DB population!")
 
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from flask import Flask
+from models.database import db
+
+# How populate_db writes the new data:
+#   "file": into a copy of the SQLite database file, swapped in when done
+#   "off": directly into the live database, in one transaction
+#   "auto": "file" for SQLite databases, "off" for the others
+POPULATE_STAGING = os.getenv("POPULATE_STAGING", "auto")
+STAGING_CHOICES = ["auto", "file", "off"]
+
+def get_sqlite_path(app):
+    # Path of the SQLite database file of the app, None for other databases
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return os.path.abspath(url.database)
+
+def use_staging_file(app, staging=POPULATE_STAGING):
+    """
+    Returns the path of the live SQLite database file if the new data must be
+    written into a staging copy of it, or None to write into the live tables.
+    Readers of MySQL and PostgreSQL keep seeing the old rows until the replace
+    transaction commits, so staging is only needed (and supported) for
+    SQLite, where a long write transaction locks the whole file.
+    """
+    if staging not in STAGING_CHOICES:
+        raise ValueError(f"Unknown staging mode: {staging}")
+    if staging == "off":
+        return None
+
+    sqlite_path = get_sqlite_path(app)
+    if staging == "file" and not sqlite_path:
+        print("[Staging] Staging file is only supported for SQLite databases, writing to the live tables.")
+    return sqlite_path
+
+@contextmanager
+def staged_app(app, live_path=None, copy_live=True):
+    """
+    Yields the Flask app to populate the database with. Without live_path,
+    that is the app itself. Otherwise, it is a copy of the app connected to
+    a staging copy of the live SQLite file: the web app keeps reading the
+    live file while the staging one is written, and on success the staging
+    file atomically replaces the live one with a rename. On error it is
+    deleted and the live file is left untouched.
+    :param app: Flask app of the web app
+    :param live_path: path of the live SQLite database file, or None
+    :param copy_live: start from a copy of the live data (False when all of
+        it is rebuilt anyway)
+    """
+    if not live_path:
+        yield app
+        return
+
+    staging_path = f"{live_path}.staging"
+    remove_sqlite_file(staging_path)
+    if copy_live and os.path.exists(live_path):
+        copy_sqlite_file(live_path, staging_path)
+
+    staging = Flask(app.import_name)
+    staging.config.update(app.config)
+    staging.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{staging_path}"
+    db.init_app(staging)
+
+    try:
+        yield staging
+    except BaseException:
+        dispose_engines(staging)
+        remove_sqlite_file(staging_path)
+        raise
+
+    dispose_engines(staging)
+    # Readers that open the file from now on get the new data, the ones
+    # already reading the old file finish on it (see utils.db_swap)
+    os.replace(staging_path, live_path)
+    print(f"[Staging] Swapped in the new database file: {live_path}")
+
+def copy_sqlite_file(source_path, target_path):
+    # Online backup: consistent copy, only blocks writers of the source
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        with target:
+            source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def remove_sqlite_file(path):
+    for file_path in (path, f"{path}-journal", f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def dispose_engines(app):
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
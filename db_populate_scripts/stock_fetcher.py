@@ -0,0 +1,140 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from data_collectors.stock_data import fetch_stock_data, fetch_chart_rows, get_timeframe_start, DB_TIMEFRAMES, \
+    TIMEFRAME_OPTIONS, DECIMAL_PRECISION
+from utils.datetime_utils import to_naive_et
+
+# Number of tickers fetched from the Polygon API at the same time
+POPULATE_MAX_WORKERS = int(os.getenv("POPULATE_MAX_WORKERS", "8"))
+
+def fetch_chart_update(stock, timeframe, now_date, latest_bar=None):
+    """
+    Fetch only the chart bars that come after the latest stored bar of the
+    stock for the given timeframe, continuing the EMAs from the stored ones.
+    The stored bar itself is fetched again and compared with the fresh one:
+    if it is missing or its close price changed (a gap in the data, a split
+    adjustment, ...), if it has no EMAs to continue from, or if it is older
+    than the timeframe window, the full window is fetched instead.
+    :param stock: Stock ORM object
+    :param timeframe: one of the DB_TIMEFRAMES
+    :param now_date: The date for which we collect the data from polygon API
+    :param latest_bar: dict with the 'date', 'close_price' and 'emas' (None
+        for timeframes without EMAs) of the latest stored bar, or None
+    :return: (chart_rows, rebuild) where chart_rows are tuples as returned by
+        fetch_chart_rows, and rebuild is True when they replace all the
+        stored rows of the stock for this timeframe
+    """
+    if latest_bar and latest_bar["date"] >= get_timeframe_start(timeframe, now_date):
+        latest_date = latest_bar["date"]
+        emas = latest_bar["emas"]
+        ema_data = TIMEFRAME_OPTIONS[timeframe].get("ema_data")
+        if not ema_data or (emas and None not in emas):
+            chart_rows = fetch_chart_rows(
+                stock.ticker, timeframe, now_date, since=latest_date,
+                ema_seed=(latest_date, emas) if ema_data else None
+            )
+            # Rows start with (date, close_price, ...)
+            overlap = [row for row in chart_rows if to_naive_et(row[0]) == latest_date]
+            if overlap and math.isclose(
+                overlap[0][1], latest_bar["close_price"], abs_tol=10 ** -DECIMAL_PRECISION / 2
+            ):
+                new_rows = [row for row in chart_rows if to_naive_et(row[0]) > latest_date]
+                return new_rows, False
+        print(f"[Chart Gap] {stock.ticker} {timeframe}: rebuilding chart data.")
+
+    return fetch_chart_rows(stock.ticker, timeframe, now_date), True
+
+def fetch_stock_with_charts(ticker, now_date, latest_bars=None):
+    """
+    Fetch the Stock object and the chart data for all the DB_TIMEFRAMES
+    for the given ticker. Any error is isolated to this ticker, so one
+    failing ticker never stops the other tickers from being fetched.
+    :param ticker: ticker symbol of a stock
+    :param now_date: The date for which we collect the data from polygon API
+    :param latest_bars: dict of timeframe -> latest stored bar of this ticker
+        (see fetch_chart_update), to only fetch the bars after it
+    :return: (stock, chart_data) tuple where chart_data is a dict of
+        timeframe -> (chart rows, rebuild) as returned by fetch_chart_update.
+        stock is None on failure.
+    """
+    latest_bars = latest_bars or {}
+    try:
+        chart_data = {}
+        stock = fetch_stock_data(ticker, now_date)
+        if stock:
+            for timeframe in DB_TIMEFRAMES:
+                chart_data[timeframe] = fetch_chart_update(
+                    stock, timeframe, now_date, latest_bars.get(timeframe)
+                )
+        return stock, chart_data
+    except Exception as e:
+        print(f"[Fetch Error] {ticker}: {e}")
+        return None, {}
+
+
+class StockFetcher:
+    """
+    Fans out ticker fetches to a thread pool. Tickers are de-duplicated
+    (case-insensitive) when submitted, and results are read back by
+    ticker, so callers decide the order in which results are used and
+    the staged data stays deterministic regardless of completion order.
+    All Polygon calls share the rate limiter of the stock_data client.
+    latest_bars is a dict of timeframe -> {ticker: latest stored bar} of the
+    stored chart data, used to only fetch new bars for known tickers.
+    With a ChartSpool, the chart rows of each ticker are moved to the spool
+    by the worker as soon as they are fetched, and the results only keep
+    empty row lists, so finished results waiting to be read stay small.
+    With RunCheckpoints, every fetched ticker is checkpointed, and tickers
+    with a usable checkpoint (when resuming) are read from it instead.
+    """
+    def __init__(self, now_date, latest_bars=None, max_workers=POPULATE_MAX_WORKERS, spool=None,
+                 checkpoints=None):
+        self.now_date = now_date
+        self.latest_bars = latest_bars or {}
+        self.spool = spool
+        self.checkpoints = checkpoints
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.futures = {}  # ticker -> Future of (stock, chart_data)
+
+    def submit(self, ticker):
+        ticker_upper = ticker.upper()
+        if ticker_upper not in self.futures:
+            ticker_latest_bars = {
+                timeframe: bars[ticker_upper]
+                for timeframe, bars in self.latest_bars.items() if ticker_upper in bars
+            }
+            self.futures[ticker_upper] = self.executor.submit(self.fetch, ticker, ticker_latest_bars)
+
+    def fetch(self, ticker, latest_bars):
+        checkpoint = self.checkpoints.load(ticker, latest_bars) if self.checkpoints else None
+        if checkpoint:
+            stock, chart_data = checkpoint
+        else:
+            stock, chart_data = fetch_stock_with_charts(ticker, self.now_date, latest_bars)
+            if stock and self.checkpoints:
+                try:
+                    self.checkpoints.save(ticker, stock, chart_data, latest_bars)
+                except OSError as e:
+                    print(f"[Checkpoint Error] {ticker}: {e}")
+
+        if stock and self.spool is not None:
+            ticker_upper = stock.ticker.upper()
+            for timeframe, (chart_rows, rebuild) in chart_data.items():
+                self.spool.add(timeframe, ticker_upper, chart_rows)
+                chart_data[timeframe] = ([], rebuild)
+        return stock, chart_data
+
+    def result(self, ticker):
+        # Submit first in case the ticker was never queued
+        self.submit(ticker)
+        return self.futures[ticker.upper()].result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, Text, ForeignKey, Date, DateTime, UniqueConstraint
+from sqlalchemy import String, Text, ForeignKey, Date, DateTime, UniqueConstraint, inspect
 from sqlalchemy import Index as DBIndex
 from datetime import datetime, date
 from utils.datetime_utils import DATE_FORMAT
@@ -118,6 +118,8 @@ class IndexHolding(db.Model):
     # Adding Index for faster performance
     __table_args__ = (
         DBIndex("ix_indexholding_indexid_stockid", "index_id", "stock_id"),
+        # Holdings of an index by weight (default sort of the index page), covering the join to stocks
+        DBIndex("ix_indexholding_indexid_weight", "index_id", "weight", "stock_id"),
     )
 
 
@@ -146,6 +148,9 @@ class StockMaster(db.Model):
     __table_args__ = (
         DBIndex("ix_stock_master_ticker", "ticker"),
         DBIndex("ix_stock_master_name", "name"),
+        # Top gainers, losers and traded stocks of the market
+        DBIndex("ix_stock_master_todays_change_perc", "todays_change_perc"),
+        DBIndex("ix_stock_master_volume", "volume"),
     )
 
 
@@ -228,3 +233,25 @@ class StockWeek(db.Model):
         # Adding Index for faster performance
         DBIndex("ix_stockweek_stockid_date", "stock_id", "date"),
     )
+
+
+# --- Migrations ---
+
+def create_missing_indexes():
+    """
+    db.create_all() only creates the tables that do not exist yet, so the
+    indexes added to the models of existing tables are created here, for
+    the database of the current app context.
+    :return: list of the names of the indexes created
+    """
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
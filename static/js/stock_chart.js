@@ -22,6 +22,7 @@ const MAX_X_TICKS = 12;
 const ZOOM_MIN_RANGE = 5; // minimum number of values to show when zoomed in
 const DISPLAY_TOOLTIP_DEFAULT = false; // OFF by default
 const CHART_SPINNER_DELAY = 200; // in ms
+const CHART_MAX_POINTS = window.innerWidth < 768 ? 300 : null; // bars fetched on small screens (null = all)
 
 // Sizing
 const VOLUME_AXIS_MAX_MULTIPLIER = 5; // volume bars take (1/multplier) height of the chart
@@ -597,15 +598,22 @@ function resetChart(button, preloadedData = null) {
   };
 
   if (preloadedData) {
-    handleChartData(preloadedData);
+    chartDataCache[timeframe] = preloadedData;
+  }
+
+  if (chartDataCache[timeframe]) {
+    // Switching back to a timeframe already shown, no need to fetch it again
+    handleChartData(chartDataCache[timeframe]);
   } else {
     stockChartSpinnerTimeout = setTimeout(showStockChartSpinner, CHART_SPINNER_DELAY);
     fetch(
-      `/chart-data?ticker=${encodeURIComponent(ticker)}&timeframe=${encodeURIComponent(timeframe)}`
+      `/chart-data?ticker=${encodeURIComponent(ticker)}&timeframe=${encodeURIComponent(timeframe)}` +
+        (CHART_MAX_POINTS ? `&max_points=${CHART_MAX_POINTS}` : "")
     )
       .then((response) => response.json())
       .then((data) => {
         hideStockChartSpinner();
+        chartDataCache[timeframe] = data;
         handleChartData(data);
       })
       .catch((error) => {
@@ -615,6 +623,8 @@ function resetChart(button, preloadedData = null) {
 }
 
 const ticker = document.getElementById("stock-chart").dataset.ticker;
+// Chart data of the timeframes already fetched for this stock
+const chartDataCache = {};
 resetChart(
   document.querySelector(`.tf-btn[data-timeframe="${initialTimeframe}"]`),
   initialStockChartData
@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+import pytz
+from polygon.rest.models import Agg
+from data_collectors.api_cache import MemoizedClient
+
+ET = pytz.timezone("America/New_York")
+
+def daily_bars(from_, to):
+    start = datetime.strptime(from_, "%Y-%m-%d")
+    end = datetime.strptime(to, "%Y-%m-%d")
+    bars = []
+    day = start
+    while day <= end:
+        bars.append(Agg(timestamp=int(ET.localize(day).timestamp() * 1000), close=1.0))
+        day += timedelta(days=1)
+    return bars
+
+class SlowClient:
+    """
+    Client whose first list_aggs call blocks until 'release' is set, so a
+    second call can start while it is in flight.
+    """
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def list_aggs(self, ticker, multiplier, timespan, from_, to, adjusted=None, sort=None, limit=None):
+        self.calls.append(from_)
+        if len(self.calls) == 1:
+            self.release.wait(5)
+        return iter(daily_bars(from_, to))
+
+class MemoizedListAggsTest(unittest.TestCase):
+    def test_overlapping_calls_with_an_earlier_start_get_all_their_bars(self):
+        api = SlowClient()
+        client = MemoizedClient(api)
+        client.start_run()
+        results = {}
+
+        def call(from_):
+            results[from_] = client.list_aggs("AAPL", 1, "day", from_, "2024-03-31")
+
+        late = threading.Thread(target=call, args=("2024-03-01",))
+        late.start()
+        while not api.calls:
+            time.sleep(0.001)
+        early = threading.Thread(target=call, args=("2024-01-01",))
+        early.start()
+        # Let the second call join the pending fetch of the first one
+        while client.stats().get("list_aggs", {}).get("hits", 0) == 0:
+            time.sleep(0.001)
+        api.release.set()
+        late.join()
+        early.join()
+
+        self.assertEqual(len(results["2024-03-01"]), 31)
+        self.assertEqual(len(results["2024-01-01"]), 91)
+        self.assertEqual(results["2024-01-01"], daily_bars("2024-01-01", "2024-03-31"))
+
+    def test_later_start_is_served_from_the_cache(self):
+        api = SlowClient()
+        api.release.set()
+        client = MemoizedClient(api)
+        client.start_run()
+
+        self.assertEqual(len(client.list_aggs("AAPL", 1, "day", "2024-01-01", "2024-03-31")), 91)
+        bars = client.list_aggs("AAPL", 1, "day", "2024-03-01", "2024-03-31", sort="desc", limit=5)
+
+        self.assertEqual(api.calls, ["2024-01-01"])
+        self.assertEqual(bars, daily_bars("2024-03-27", "2024-03-31")[::-1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from utils.db_queries.query_stocks import StockSearchIndex, tokenize_name
+
+# (ticker, name, popularity), most popular first
+STOCKS = [
+    ("NVDA", "NVIDIA Corporation", 100),
+    ("MSFT", "Microsoft Corporation", 95),
+    ("AAPL", "Apple Inc.", 90),
+    ("AMZN", "Amazon.com, Inc.", 85),
+    ("GOOGL", "Alphabet Inc. Class A Common Stock", 80),
+    ("META", "Meta Platforms, Inc. Class A Common Stock", 75),
+    ("TSLA", "Tesla, Inc. Common Stock", 70),
+    ("AVGO", "Broadcom Inc. Common Stock", 65),
+    ("WMT", "Walmart Inc. Common Stock", 60),
+    ("INTC", "Intel Corporation", 20),
+    ("INTU", "Intuit Inc.", 15),
+    ("C", "Citigroup Inc. Common Stock", 10),
+    ("BAC", "Bank of America Corporation", 9),
+    ("CSCO", "Cisco Systems, Inc.", 8),
+    ("EBAY", "eBay Inc.", 5),
+]
+
+def tickers(matches):
+    return [ticker for ticker, _ in matches]
+
+class StockSearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = StockSearchIndex(STOCKS)
+
+    def test_filler_words_are_not_indexed(self):
+        self.assertEqual(tokenize_name("Alphabet Inc. - Class A Common Stock"), ["ALPHABET"])
+        self.assertEqual(tokenize_name("Bank of America Corporation"), ["BANK", "AMERICA"])
+
+    def test_ticker_and_name_prefixes_only_match_their_stocks(self):
+        # Not every stock with "Inc." in its name, the most popular first
+        self.assertEqual(tickers(self.index.search("IN")), ["INTC", "INTU"])
+        self.assertEqual(tickers(self.index.search("int")), ["INTC", "INTU"])
+
+    def test_ticker_and_name_matches_come_before_name_word_matches(self):
+        # Citigroup and Cisco, not the more popular stocks with CORPORATION or COMMON in their names
+        self.assertEqual(tickers(self.index.search("C")), ["C", "CSCO"])
+        # Amazon starts with the query, Bank of America only has a word starting with it
+        self.assertEqual(tickers(self.index.search("am")), ["AMZN", "BAC"])
+        self.assertEqual(tickers(self.index.search("PLATF")), ["META"])
+
+    def test_limit_and_case(self):
+        self.assertEqual(tickers(self.index.search("a", limit=3)), ["AAPL", "AMZN", "GOOGL"])
+        self.assertEqual(tickers(self.index.search("e")), ["EBAY"])
+        self.assertEqual(self.index.search("  "), [])
+
+    def test_typo_when_nothing_starts_with_the_query(self):
+        self.assertEqual(tickers(self.index.search("ITNEL")), ["INTC"])
+
+if __name__ == "__main__":
+    unittest.main()
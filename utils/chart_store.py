@@ -0,0 +1,227 @@
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+import numpy as np
+from numpy.lib.format import open_memmap
+from models.database import db, Stock
+from data_collectors.stock_data import TIMEFRAME_OPTIONS, SELECT_DB_TABLE, DB_TIMEFRAMES, get_chart_columns, \
+    get_parent_timeframe, get_timeframe_start
+from utils.datetime_utils import to_naive_et
+from utils.populate_db_info import get_data_dir, load_populate_db_info, db_last_updated_date
+
+# Folder of the chart stores in the data folder, one sub folder per populate db run
+CHART_STORE_DIR = "chart_store"
+CHART_STORE_INDEX_FILE = "index.json"
+
+# Number of chart rows read from the database at once when building a store
+CHART_STORE_BATCH_ROWS = int(os.getenv("POPULATE_BATCH_ROWS", "5000"))
+
+# Stored volumes are never negative, this one marks a missing volume
+MISSING_VOLUME = -1
+
+EPOCH = datetime(1970, 1, 1)
+
+# Dates are stored as seconds since the epoch, the other columns as floats
+COLUMN_DTYPES = {"date": "int64", "volume": "int64"}
+
+def get_store_columns(timeframe):
+    # Columns stored for a timeframe: (name, dtype)
+    return [(column, COLUMN_DTYPES.get(column, "float64")) for column in get_chart_columns(timeframe)]
+
+def get_label_dtype(timeframe):
+    # Fixed width unicode dtype of the formatted dates of a timeframe
+    label = datetime(2000, 12, 31, 12, 59).strftime(TIMEFRAME_OPTIONS[timeframe]["date_format"])
+    return f"U{len(label)}"
+
+def build_chart_store(now):
+    """
+    Writes the chart data of all the stocks of the database (in the current
+    app context) into a new chart store: for each of the DB_TIMEFRAMES, one
+    .npy file per column holding the bars of all the stocks back to back,
+    ordered by stock and date, and an index of the [start, end) range of
+    every ticker. Dates are stored both as seconds since the epoch (ET wall
+    time) and formatted for the charts, so serving a chart is a matter of
+    slicing the arrays.
+    Rows are copied in batches straight into memory mapped files.
+    :param now: datetime of the populate db run
+    :return: name of the new chart store, see save_populate_db_info
+    """
+    name = f"{now.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    store_dir = get_data_dir() / CHART_STORE_DIR / name
+    shutil.rmtree(store_dir, ignore_errors=True)
+    store_dir.mkdir(parents=True)
+
+    tickers = dict(db.session.query(Stock.id, Stock.ticker).all())
+    index = {}
+    for timeframe in DB_TIMEFRAMES:
+        db_table = SELECT_DB_TABLE.get(TIMEFRAME_OPTIONS[timeframe]["timespan"])
+        columns = get_store_columns(timeframe)
+        date_format = TIMEFRAME_OPTIONS[timeframe]["date_format"]
+        num_rows = db.session.query(db_table.id).count()
+
+        arrays = {
+            column: open_memmap(store_dir / f"{timeframe}.{column}.npy", mode="w+", dtype=dtype, shape=(num_rows,))
+            for column, dtype in columns
+        }
+        labels = open_memmap(store_dir / f"{timeframe}.label.npy", mode="w+",
+                             dtype=get_label_dtype(timeframe), shape=(num_rows,))
+
+        rows = db.session.execute(
+            db.select(db_table.stock_id, *[getattr(db_table, column) for column, _ in columns])
+            .order_by(db_table.stock_id, db_table.date)
+            .execution_options(yield_per=CHART_STORE_BATCH_ROWS)
+        )
+        # Ticker -> [start, end) of its bars, every stock has one even without bars
+        ranges = {ticker: [0, 0] for ticker in tickers.values()}
+        position = 0
+        for batch in rows.partitions():
+            # Rows added to the table meanwhile do not fit, they are in the next store
+            batch = batch[:num_rows - position]
+            if not batch:
+                break
+            size = len(batch)
+            stock_ids, dates, *values = zip(*batch)
+            dates = [to_naive_et(date) for date in dates]
+            arrays["date"][position:position + size] = [int((date - EPOCH).total_seconds()) for date in dates]
+            labels[position:position + size] = [date.strftime(date_format) for date in dates]
+            for (column, dtype), column_values in zip(columns[1:], values):
+                if column == "volume":
+                    column_values = [MISSING_VOLUME if value is None else value for value in column_values]
+                else:
+                    column_values = [np.nan if value is None else value for value in column_values]
+                arrays[column][position:position + size] = column_values
+
+            for offset, stock_id in enumerate(stock_ids):
+                ticker = tickers.get(stock_id)
+                if ticker is None:
+                    continue
+                ticker_range = ranges[ticker]
+                if ticker_range[1] == 0:
+                    ticker_range[0] = position + offset
+                ticker_range[1] = position + offset + 1
+            position += size
+
+        for array in (*arrays.values(), labels):
+            array.flush()
+        del arrays, labels
+        index[timeframe] = ranges
+
+    with open(store_dir / CHART_STORE_INDEX_FILE, "w") as f:
+        json.dump({"timeframes": index}, f)
+    return name
+
+def remove_old_chart_stores(keep):
+    """
+    Deletes the chart stores of the previous populate db runs. The app
+    memory maps the files of the current one, the processes still using an
+    old one keep reading it until they move on to the new generation.
+    :param keep: name of the chart store in use
+    """
+    stores_dir = get_data_dir() / CHART_STORE_DIR
+    if not stores_dir.exists():
+        return
+    for store_dir in stores_dir.iterdir():
+        if store_dir.name != keep:
+            shutil.rmtree(store_dir, ignore_errors=True)
+
+def to_json_list(values, missing):
+    # Missing values (NaN floats, negative volumes) become None, like NULL columns
+    if missing.any():
+        return np.where(missing, None, values.astype(object)).tolist()
+    return values.tolist()
+
+class ChartStore:
+    """
+    Read-only view of a chart store written by build_chart_store, with the
+    column files memory mapped, so the processes of the app share them and
+    only the pages of the charts served are read from disk.
+    """
+    def __init__(self, store_dir):
+        with open(store_dir / CHART_STORE_INDEX_FILE) as f:
+            self.index = json.load(f)["timeframes"]
+        self.arrays = {}
+        for timeframe in self.index:
+            for column, _ in [*get_store_columns(timeframe), ("label", None)]:
+                self.arrays[(timeframe, column)] = np.load(store_dir / f"{timeframe}.{column}.npy", mmap_mode="r")
+
+    def get_range(self, ticker, timeframe):
+        return self.index.get(timeframe, {}).get(ticker)
+
+    def get_column(self, timeframe, column, start, end):
+        return self.arrays[(timeframe, column)][start:end]
+
+    def get_bounds(self, ticker, timeframe, now=None):
+        """
+        Returns (parent timeframe, start, end) of the bars of the chart of
+        the ticker for the timeframe, or None if it is not in the store.
+        Timeframes that are not stored are the end of their parent timeframe
+        (see get_parent_timeframe), found by binary search on its dates.
+        :param now: date string the chart windows end on (default: last populate db date)
+        """
+        parent = get_parent_timeframe(timeframe)
+        ticker_range = self.get_range(ticker, parent)
+        if ticker_range is None:
+            return None
+        start, end = ticker_range
+        if timeframe != parent:
+            before = get_timeframe_start(timeframe, now or db_last_updated_date())
+            dates = self.get_column(parent, "date", start, end)
+            start += int(np.searchsorted(dates, int((before - EPOCH).total_seconds()), side="left"))
+        return parent, start, end
+
+    def get_payload(self, ticker, timeframe, now=None):
+        """
+        Returns the chart data of the ticker for the timeframe, in the format
+        of show_stock.get_chart_data, or None if it is not in the store.
+        """
+        bounds = self.get_bounds(ticker, timeframe, now)
+        if bounds is None:
+            return None
+        parent, start, end = bounds
+
+        ema_data = TIMEFRAME_OPTIONS[timeframe].get("ema_data")
+        close_prices = self.get_column(parent, "close_price", start, end)
+        volumes = self.get_column(parent, "volume", start, end)
+        close_price_data = to_json_list(close_prices, np.isnan(close_prices))
+        result = {
+            "date_data": self.get_column(parent, "label", start, end).tolist(),
+            "close_price_data": close_price_data,
+            "volume_data": to_json_list(volumes, volumes == MISSING_VOLUME),
+            "ema_30_data": [],
+            "ema_50_data": [],
+            "ema_200_data": [],
+            "change_perc": 0,
+            "ema_data": ema_data,
+        }
+        if ema_data:
+            for column in ["ema_30", "ema_50", "ema_200"]:
+                emas = self.get_column(parent, column, start, end)
+                result[f"{column}_data"] = to_json_list(emas, np.isnan(emas))
+        if len(close_price_data) > 1:
+            result["change_perc"] = round(((close_price_data[-1] - close_price_data[0]) * 100 / close_price_data[0]), 2)
+        return result
+
+# Chart store of the current data generation, reopened when populate db updates the data
+chart_store = {"name": None, "store": None}
+chart_store_lock = threading.Lock()
+
+def get_chart_store():
+    """
+    Returns the ChartStore of the current data generation, or None if
+    populate db has not built one (the charts are then read from the
+    database).
+    """
+    name = load_populate_db_info().get("chart_store")
+    with chart_store_lock:
+        if chart_store["name"] != name:
+            store = None
+            if name:
+                try:
+                    store = ChartStore(get_data_dir() / CHART_STORE_DIR / name)
+                except OSError as e:
+                    print(f"[Chart Store Error] {name}: {e}")
+            chart_store["store"] = store
+            chart_store["name"] = name
+        return chart_store["store"]
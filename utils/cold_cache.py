@@ -0,0 +1,111 @@
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from utils.populate_db_info import get_data_dir, db_generation
+
+# Folder of the cache in the data folder, one sub folder per data generation
+COLD_CACHE_DIR = "cold_cache"
+
+# Seconds the data fetched for a stock that is not in the database is reused
+# (0 = until populate db changes the data)
+COLD_CACHE_TTL = float(os.getenv("COLD_CACHE_TTL", "21600"))
+
+class ColdCache:
+    """
+    On-disk cache of the data fetched from the Polygon API in a request,
+    for the stocks that are not in the database (the cold path), so the
+    next visitors of the stock, in any process of the app and after a
+    restart, do not wait for the same API calls again.
+    Entries are pickle files in a folder of the current data generation,
+    the folders of the previous generations are deleted when a new one
+    starts, and an entry older than the TTL is fetched again.
+    Concurrent requests of the same entry in a process share one fetch.
+    """
+    def __init__(self, ttl=COLD_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.pending = {}  # key -> Future of the fetch in progress
+        self.generation = None
+
+    def get_path(self, generation, key):
+        # Tickers may hold characters that are not valid in file names
+        name = hashlib.md5(repr(key).encode()).hexdigest()
+        return get_data_dir() / COLD_CACHE_DIR / str(generation) / f"{name}.pkl"
+
+    def load(self, path):
+        try:
+            if self.ttl > 0 and time.time() - path.stat().st_mtime > self.ttl:
+                return False, None
+            with open(path, "rb") as f:
+                return True, pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:
+            print(f"[Cold Cache Error] {path.name}: {e}")
+            return False, None
+
+    def save(self, path, value):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(temp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Never leave a half written entry behind
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"[Cold Cache Error] {path.name}: {e}")
+
+    def remove_old_generations(self, generation):
+        cache_dir = get_data_dir() / COLD_CACHE_DIR
+        if not cache_dir.exists():
+            return
+        for generation_dir in cache_dir.iterdir():
+            if generation_dir.name != str(generation):
+                shutil.rmtree(generation_dir, ignore_errors=True)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Returns the cached value of the key, or the value returned by
+        fetch(), which is then cached. Errors raised by fetch() are not.
+        :param key: tuple identifying the data, e.g. ("chart", ticker, timeframe)
+        :param fetch: function fetching the data, its result must be picklable
+        """
+        generation = db_generation()
+        path = self.get_path(generation, key)
+        found, value = self.load(path)
+        if found:
+            return value
+
+        with self.lock:
+            future = self.pending.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.pending[key] = future
+            new_generation = generation != self.generation
+            self.generation = generation
+        if not leader:
+            return future.result()
+
+        try:
+            if new_generation:
+                self.remove_old_generations(generation)
+            # Another request may have cached it meanwhile
+            found, value = self.load(path)
+            if not found:
+                value = fetch()
+                self.save(path, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+cold_cache = ColdCache()
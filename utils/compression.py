@@ -0,0 +1,117 @@
+import functools
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from flask import make_response, request
+from utils.http_cache import make_etag
+
+# Brotli is in requirements.txt, an install without it only serves gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Max total size (in MB) of the response variants kept in memory
+COMPRESSION_CACHE_MAX_MB = float(os.getenv("COMPRESSION_CACHE_MAX_MB", "64"))
+
+# Responses smaller than this many bytes are not worth compressing
+COMPRESSION_MIN_BYTES = 1024
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+def get_encodings():
+    # Supported encodings, most compact first
+    encodings = ["gzip", "identity"]
+    if brotli is not None:
+        encodings.insert(0, "br")
+    return encodings
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
+
+class VariantCache:
+    """
+    LRU cache of the bodies of the responses of the routes that only change
+    with the data generation, one variant per content encoding, so that a
+    response is rendered and compressed once per generation instead of on
+    every request. Bounded by the total size of the bodies.
+    """
+    def __init__(self, max_mb=COMPRESSION_CACHE_MAX_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.variants = OrderedDict()  # (url, accepted encoding) -> (content type, encoding, body)
+        self.size = 0
+        self.etag = None
+
+    def get(self, etag, key):
+        with self.lock:
+            # New data generation or app version, all the variants are stale
+            if etag != self.etag:
+                self.variants.clear()
+                self.size = 0
+                self.etag = etag
+            variant = self.variants.get(key)
+            if variant is not None:
+                self.variants.move_to_end(key)
+            return variant
+
+    def set(self, etag, key, variant):
+        size = len(variant[2])
+        with self.lock:
+            if etag != self.etag or size > self.max_bytes:
+                return
+            old_variant = self.variants.pop(key, None)
+            if old_variant is not None:
+                self.size -= len(old_variant[2])
+            self.variants[key] = variant
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, body) = self.variants.popitem(last=False)
+                self.size -= len(body)
+
+variant_cache = VariantCache()
+
+def precompressed(view):
+    """
+    Decorator of the routes whose responses only change with the data
+    generation (see utils.http_cache): serves the body in the best encoding
+    the client accepts (brotli, gzip or none), from the variant cache when
+    it was already built for this generation, without running the view.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        encoding = request.accept_encodings.best_match(get_encodings(), default="identity")
+        etag = make_etag()
+        url = request.full_path
+
+        variant = variant_cache.get(etag, (url, encoding))
+        if variant is None:
+            # All the encodings are built from the identity variant, rendered once
+            identity = variant_cache.get(etag, (url, "identity"))
+            if identity is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                identity = (response.content_type, "identity", response.get_data())
+                variant_cache.set(etag, (url, "identity"), identity)
+
+            content_type, _, body = identity
+            used_encoding = encoding if len(body) >= COMPRESSION_MIN_BYTES else "identity"
+            variant = (content_type, used_encoding, compress(body, used_encoding))
+            variant_cache.set(etag, (url, encoding), variant)
+
+        content_type, encoding, body = variant
+        response = make_response(body)
+        response.content_type = content_type
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
+    wrapper.vary = ["Accept-Encoding"]
+    return wrapper
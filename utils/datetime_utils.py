@@ -30,6 +30,17 @@ def polygon_timestamp_et(timestamp, timestamp_type):
 
     return eastern_dt
 
+def to_naive_et(dt):
+    """
+    Returns the wall time of the given datetime in ET without tzinfo.
+    Stored datetimes come back naive from some databases (SQLite, MySQL)
+    and aware from others, so compare them in this form.
+    """
+    if dt is not None and dt.tzinfo is not None:
+        eastern_tz = pytz.timezone('US/Eastern')
+        dt = dt.astimezone(eastern_tz).replace(tzinfo=None)
+    return dt
+
 def get_current_et():
     eastern = pytz.timezone("US/Eastern")
     return datetime.now(eastern)
@@ -1,5 +1,11 @@
 from models.database import db, Index
+from utils.query_cache import cached_query
 
+# Columns of the indices shown on the pages: cached as plain rows, never as
+# ORM objects, which would be detached from the session of later requests
+INDEX_COLUMNS = [Index.id, Index.name, Index.slug, Index.last_updated]
+
+@cached_query
 def get_all_indices():
-    all_indices = db.session.execute(db.select(Index)).scalars().all()
+    all_indices = db.session.execute(db.select(*INDEX_COLUMNS)).all()
     return all_indices
\ No newline at end of file
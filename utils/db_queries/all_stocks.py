@@ -1,11 +1,38 @@
+import json
+import os
 import random
+import threading
+from collections import namedtuple
 from sqlalchemy import or_
 from models.database import db, StockMaster, Stock, Index, IndexHolding
+from utils.populate_db_info import get_data_dir, db_generation
 
 # Number of top stocks to be shown for each category
 NUM_TOP_STOCKS = 50
 
-def get_ticker_tape_stocks():
+# Top stocks computed at the end of populate_db, in the data folder
+TOP_STOCKS_SNAPSHOT_FILE = "top_stocks.json"
+
+# Ticker tape: the top Nasdaq 100 stocks, plus random ones of the Nasdaq 100 and of the market
+NUM_TAPE_TOP_STOCKS = 10
+NUM_TAPE_NASDAQ100_STOCKS = 20
+NUM_TAPE_RANDOM_STOCKS = 20
+
+# Number of ticker tapes drawn once per data generation and served in turn
+# (0 = a new tape is drawn for every request)
+TICKER_TAPE_SETS = int(os.getenv("TICKER_TAPE_SETS", "0"))
+
+TapeStock = namedtuple("TapeStock", ["ticker", "volume", "day_close", "todays_change"])
+
+# Ticker tape candidates of the current data generation
+ticker_tape = {"generation": None, "candidates": None, "tapes": [], "next_tape": 0}
+ticker_tape_lock = threading.Lock()
+
+# Last loaded snapshot, reloaded when the file changes
+top_stocks_snapshot = {"file_id": None, "top_stocks": None}
+top_stocks_snapshot_lock = threading.Lock()
+
+def load_ticker_tape_candidates():
     # Get all stocks in Nasdaq 100 Index in descending order of weight
     nasdaq100_stocks = (db.session.query(
         Stock.ticker,
@@ -28,17 +55,57 @@ def get_ticker_tape_stocks():
         StockMaster.todays_change,
     ).all())
 
+    return {
+        "top": [TapeStock(*stock) for stock in nasdaq100_stocks[:NUM_TAPE_TOP_STOCKS]],
+        "nasdaq100": [TapeStock(*stock) for stock in nasdaq100_stocks[NUM_TAPE_TOP_STOCKS:]],
+        "all": [TapeStock(*stock) for stock in all_stocks_data],
+    }
+
+def get_ticker_tape_candidates():
+    """
+    Returns the stocks the ticker tape is drawn from, loaded once per data
+    generation, with the precomputed tapes if TICKER_TAPE_SETS is set.
+    """
+    generation = db_generation()
+    with ticker_tape_lock:
+        if ticker_tape["generation"] != generation:
+            candidates = load_ticker_tape_candidates()
+            ticker_tape["candidates"] = candidates
+            ticker_tape["tapes"] = [sample_ticker_tape(candidates) for _ in range(TICKER_TAPE_SETS)]
+            ticker_tape["next_tape"] = 0
+            ticker_tape["generation"] = generation
+        return ticker_tape
+
+def sample_ticker_tape(candidates):
     # Get top 10 stocks in nasdaq100
-    ticker_tape_stocks = nasdaq100_stocks[:10]
+    ticker_tape_stocks = list(candidates["top"])
     # Add 20 random stocks from remaining stocks in nasdaq100
-    ticker_tape_stocks.extend(random.sample(nasdaq100_stocks[10:], 20))
+    nasdaq100_stocks = candidates["nasdaq100"]
+    ticker_tape_stocks.extend(random.sample(nasdaq100_stocks, min(NUM_TAPE_NASDAQ100_STOCKS, len(nasdaq100_stocks))))
     # Add 20 random stocks from all stocks in StockMaster Table
-    ticker_tape_stocks.extend(random.sample(all_stocks_data, 20))
+    all_stocks_data = candidates["all"]
+    ticker_tape_stocks.extend(random.sample(all_stocks_data, min(NUM_TAPE_RANDOM_STOCKS, len(all_stocks_data))))
     # Shuffle the selected 50 ticker tape stocks
     random.shuffle(ticker_tape_stocks)
 
     return ticker_tape_stocks
 
+def get_ticker_tape_stocks():
+    """
+    Returns the 50 stocks of the ticker tape: the top 10 of the Nasdaq 100,
+    20 other random ones from it and 20 random stocks of the market. They
+    are drawn from the candidates kept in memory for the data generation
+    (random.sample only picks the k stocks drawn), or the next precomputed
+    tape is served in turn if TICKER_TAPE_SETS is set.
+    """
+    state = get_ticker_tape_candidates()
+    if state["tapes"]:
+        with ticker_tape_lock:
+            tape = state["tapes"][state["next_tape"] % len(state["tapes"])]
+            state["next_tape"] += 1
+        return tape
+    return sample_ticker_tape(state["candidates"])
+
 def get_top_stocks():
     """
     Collects and returns the top gainers, losers, and top traded stocks
@@ -137,3 +204,37 @@ def add_to_top_stocks(top_stocks, key, name, gainers, losers, top_traded):
         }
     }
     return top_stocks
+
+def serialize_top_stocks(top_stocks):
+    # Same structure as get_top_stocks, with plain dicts instead of rows
+    return {
+        key: {
+            "name": top_stocks_category.get("name"),
+            "category": {
+                category: [stock._asdict() for stock in category_stocks]
+                for category, category_stocks in top_stocks_category.get("category").items()
+            }
+        }
+        for key, top_stocks_category in top_stocks.items()
+    }
+
+def get_top_stocks_snapshot():
+    """
+    Returns the top stocks precomputed by populate_db, from memory. The
+    snapshot file is only read again when populate_db replaces it. Without
+    a snapshot file (e.g. before the first run), they are queried instead.
+    :return: top_stocks dict, see get_top_stocks
+    """
+    data_path = get_data_dir() / TOP_STOCKS_SNAPSHOT_FILE
+    try:
+        stat = data_path.stat()
+    except OSError:
+        return serialize_top_stocks(get_top_stocks())
+
+    file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with top_stocks_snapshot_lock:
+        if top_stocks_snapshot["file_id"] != file_id:
+            with open(data_path) as f:
+                top_stocks_snapshot["top_stocks"] = json.load(f)
+            top_stocks_snapshot["file_id"] = file_id
+        return top_stocks_snapshot["top_stocks"]
@@ -1,29 +1,186 @@
+import bisect
+import heapq
+import os
+import re
+import threading
 from flask import jsonify
 from sqlalchemy import func
 from models.database import db, StockMaster
+from utils.populate_db_info import db_generation
+
+# Suggest tickers one typo away from the query when nothing starts with it ("0" to turn it off)
+QUERY_STOCKS_FUZZY = os.getenv("QUERY_STOCKS_FUZZY", "1") == "1"
+
+# Shortest query matched with typos, shorter ones match too many tickers
+FUZZY_MIN_LENGTH = 3
+
+# Top suggestions precomputed for every prefix up to this length, the
+# shortest prefixes match the most keys and would be the slowest lookups
+TOP_PREFIX_LENGTH = 2
+
+NUM_SUGGESTIONS = 10
 
 def get_query_stocks(query):
     result = jsonify([])
-    num_suggestions = 10
 
     if query:
-        query_upper = query.upper()
-        # Estimate popularity using (day close price) * volume
-        popularity = func.coalesce(StockMaster.day_close, 0) * func.coalesce(StockMaster.volume, 0)
-
-        # One combined query for both ticker and name startswith, ordered by popularity
-        matches = (
-            db.session.query(
-                StockMaster.ticker,
-                StockMaster.name
-            )
-            .filter(
-                StockMaster.ticker.ilike(f"{query_upper}%") |
-                StockMaster.name.ilike(f"{query}%")
-            )
-            .order_by(popularity.desc())
-            .limit(num_suggestions)
-            .all()
-        )
-        result = jsonify([{"ticker": match.ticker, "name": match.name} for match in matches])
-    return result
\ No newline at end of file
+        matches = get_search_index().search(query, NUM_SUGGESTIONS)
+        result = jsonify([{"ticker": ticker, "name": name} for ticker, name in matches])
+    return result
+
+# Words of company names that say nothing about the company, matched by
+# most stocks, e.g. "Alphabet Inc. - Class A"
+NAME_FILLER_WORDS = {
+    "A", "ADR", "AG", "AND", "B", "C", "CL", "CLASS", "CO", "COM", "COMMON", "COMPANY", "CORP", "CORPORATION",
+    "DE", "DEPOSITARY", "GROUP", "HOLDING", "HOLDINGS", "INC", "INCORPORATED", "LLC", "LP", "LTD", "LIMITED",
+    "N", "NEW", "NV", "OF", "ORDINARY", "PLC", "S", "SA", "SE", "SHARES", "SHS", "STOCK", "THE", "TRUST",
+}
+
+def tokenize_name(name):
+    # Words of a company name without the filler ones, e.g. "Alphabet Inc. - Class A" -> ALPHABET
+    return [token for token in re.split(r"[^0-9A-Z]+", name.upper()) if token and token not in NAME_FILLER_WORDS]
+
+def within_one_edit(query, key):
+    """
+    Returns True if the query can be turned into the key with at most one
+    inserted, deleted, replaced or swapped (adjacent) character.
+    """
+    if query == key:
+        return True
+    len_query, len_key = len(query), len(key)
+    if abs(len_query - len_key) > 1:
+        return False
+
+    # Skip the common start, the typo is at the first different character
+    i = 0
+    while i < len_query and i < len_key and query[i] == key[i]:
+        i += 1
+    if len_query == len_key:
+        return (query[i + 1:] == key[i + 1:] or
+                (query[i + 1:i + 2] == key[i:i + 1] and query[i:i + 1] == key[i + 1:i + 2] and query[i + 2:] == key[i + 2:]))
+    if len_query < len_key:
+        return query[i:] == key[i + 1:]
+    return query[i + 1:] == key[i:]
+
+class SearchKeys:
+    """
+    Sorted array of search keys, each pointing to the ranks of the stocks
+    it belongs to, with the best ranks of the shortest prefixes precomputed.
+    """
+    def __init__(self, key_ranks):
+        """
+        :param key_ranks: dict of key -> ranks of its stocks, in increasing order
+        """
+        self.keys = sorted(key_ranks)
+        # Ranks are added in increasing order, the first ones are the best
+        self.ranks = [key_ranks[key] for key in self.keys]
+
+        # Best ranks of the shortest prefixes, matched by most of the keys
+        self.top_ranks = {}
+        for key, ranks in zip(self.keys, self.ranks):
+            for length in range(1, min(TOP_PREFIX_LENGTH, len(key)) + 1):
+                self.top_ranks.setdefault(key[:length], set()).update(ranks[:NUM_SUGGESTIONS])
+        for prefix, ranks in self.top_ranks.items():
+            self.top_ranks[prefix] = sorted(ranks)[:NUM_SUGGESTIONS]
+
+    def prefix_ranks(self, prefix, limit):
+        if len(prefix) <= TOP_PREFIX_LENGTH and limit <= NUM_SUGGESTIONS:
+            return self.top_ranks.get(prefix, [])[:limit]
+
+        start = bisect.bisect_left(self.keys, prefix)
+        # Every key starting with the prefix sorts before prefix + a char after all the others
+        end = bisect.bisect_left(self.keys, prefix + "\uffff", start)
+        ranks = set()
+        for key_ranks in self.ranks[start:end]:
+            ranks.update(key_ranks[:limit])
+        return heapq.nsmallest(limit, ranks)
+
+    def fuzzy_ranks(self, prefix, limit):
+        # Keys starting with the first letter of the query, whose start is one typo away from it
+        start = bisect.bisect_left(self.keys, prefix[0])
+        end = bisect.bisect_left(self.keys, prefix[0] + "\uffff", start)
+        ranks = set()
+        for index in range(start, end):
+            key = self.keys[index]
+            if any(within_one_edit(prefix, key[:length]) for length in (len(prefix) - 1, len(prefix), len(prefix) + 1)):
+                ranks.update(self.ranks[index][:limit])
+        return heapq.nsmallest(limit, ranks)
+
+class StockSearchIndex:
+    """
+    In-memory search index of the tickers and company names of the stock
+    master, for the search bar suggestions.
+    Stocks are ranked once by popularity, estimated as day close * volume
+    like the old query. The stocks whose ticker or full name starts with
+    the query (the matches of the old query) come first, most popular
+    first, then the ones with another word of the name starting with it
+    (filler words like INC or CLASS left out). Each kind of key is a
+    SearchKeys: a prefix lookup is a binary search for the range of keys
+    starting with the query, and the suggestions are the best ranks in it.
+    """
+    def __init__(self, rows):
+        """
+        :param rows: (ticker, name, popularity) of every stock
+        """
+        rows = sorted(rows, key=lambda row: (-row[2], row[0]))
+        self.stocks = [(ticker, name) for ticker, name, _ in rows]
+
+        name_ranks = {}
+        word_ranks = {}
+        for rank, (ticker, name) in enumerate(self.stocks):
+            keys = {ticker.upper()}
+            words = set()
+            if name:
+                keys.add(name.upper())
+                words.update(tokenize_name(name))
+            for key in keys:
+                name_ranks.setdefault(key, []).append(rank)
+            for word in words:
+                word_ranks.setdefault(word, []).append(rank)
+
+        # Tickers and full names, then the words of the names
+        self.key_tiers = [SearchKeys(name_ranks), SearchKeys(word_ranks)]
+
+    def search(self, query, limit=NUM_SUGGESTIONS):
+        """
+        :param query: start of a ticker, of a company name or of a word of it
+        :param limit: max number of suggestions
+        :return: list of (ticker, name), ticker and full name matches first,
+            then name word matches, each most popular first
+        """
+        prefix = query.strip().upper()
+        if not prefix:
+            return []
+
+        ranks = self.tier_ranks(lambda keys, count: keys.prefix_ranks(prefix, count), limit)
+        if not ranks and QUERY_STOCKS_FUZZY and len(prefix) >= FUZZY_MIN_LENGTH:
+            ranks = self.tier_ranks(lambda keys, count: keys.fuzzy_ranks(prefix, count), limit)
+        return [self.stocks[rank] for rank in ranks]
+
+    def tier_ranks(self, lookup, limit):
+        # The ranks found in every tier of keys in turn, without duplicates, until there are enough.
+        # A tier is asked for as many more as were found before, they may be among its best ones
+        ranks = []
+        for keys in self.key_tiers:
+            ranks.extend(rank for rank in lookup(keys, limit + len(ranks)) if rank not in ranks)
+            if len(ranks) >= limit:
+                break
+        return ranks[:limit]
+
+# Search index of the current data generation, rebuilt when populate db updates the data
+search_index = {"generation": None, "index": None}
+search_index_lock = threading.Lock()
+
+def load_search_index():
+    # Estimate popularity using (day close price) * volume
+    popularity = func.coalesce(StockMaster.day_close, 0) * func.coalesce(StockMaster.volume, 0)
+    rows = db.session.query(StockMaster.ticker, StockMaster.name, popularity).all()
+    return StockSearchIndex(rows)
+
+def get_search_index():
+    generation = db_generation()
+    with search_index_lock:
+        if search_index["index"] is None or search_index["generation"] != generation:
+            search_index["index"] = load_search_index()
+            search_index["generation"] = generation
+        return search_index["index"]
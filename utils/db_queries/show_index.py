@@ -1,6 +1,12 @@
-from models.database import db, Stock, Index, IndexHolding
-from sqlalchemy import and_, or_
+import threading
+import numpy as np
+from flask import abort
+from models.database import db, Stock, IndexHolding
+from utils.populate_db_info import db_generation
+from utils.db_queries.all_indices import INDEX_COLUMNS
 
+# Not memoized by the query cache: the index view already is, per data
+# generation, and selecting a page from it takes microseconds
 def get_index_data(index_id, sort_by, order, filter_by):
     valid_sort_by = {"weight", "name", "todays_change", "perc_diff"}
     valid_order = {"asc", "desc"}
@@ -25,29 +31,6 @@ def get_index_data(index_id, sort_by, order, filter_by):
         {"label": "200-DMA % Diff (Low to High)", "sort_by": "perc_diff", "order": "asc"},
     ]
 
-    sort_options = {
-        ("weight", "asc"): IndexHolding.weight.asc(),
-        ("name", "desc"): Stock.name.desc(),
-        ("name", "asc"): Stock.name.asc(),
-        ("todays_change", "desc"): Stock.todays_change_perc.desc(),
-        ("todays_change", "asc"): Stock.todays_change_perc.asc(),
-        ("perc_diff", "desc"): Stock.dma_200_perc_diff.desc(),
-        ("perc_diff", "asc"): Stock.dma_200_perc_diff.asc(),
-    }
-
-    # Build filtering conditions
-    filter_conditions = []
-    for color in filter_by:
-        if color == "dark_green":
-            filter_conditions.append(Stock.dma_200_perc_diff >= 10)
-        elif color == "green":
-            filter_conditions.append(and_(Stock.dma_200_perc_diff >= 2, Stock.dma_200_perc_diff < 10))
-        elif color == "yellow":
-            filter_conditions.append(and_(Stock.dma_200_perc_diff >= -2, Stock.dma_200_perc_diff < 2))
-        elif color == "red":
-            filter_conditions.append(and_(Stock.dma_200_perc_diff >= -10, Stock.dma_200_perc_diff < -2))
-        elif color == "dark_red":
-            filter_conditions.append(Stock.dma_200_perc_diff < -10)
     # Colour options and associated dummy values for the filter
     filter_colors = {
         "dark_green": 15,
@@ -57,10 +40,108 @@ def get_index_data(index_id, sort_by, order, filter_by):
         "dark_red": -15
     }
 
+    # Holdings of the index, sorted and filtered in memory
+    index_view = get_index_view(index_id)
+    index = index_view.index
+    index_data = index_view.select(sort_by, order, filter_by, include_missing=set(filter_by) == valid_filter)
+
+    result = {
+        "index": index,
+        "index_data": index_data,
+        "sort_dropdown_options": sort_dropdown_options,
+        "filter_colors": filter_colors
+    }
+
+    return result
+
+# Sort options: (sort_by, order) -> (column of the index view, descending)
+SORT_OPTIONS = {
+    (None, None): ("weight", True),
+    ("weight", "asc"): ("weight", False),
+    ("name", "desc"): ("stock_name", True),
+    ("name", "asc"): ("stock_name", False),
+    ("todays_change", "desc"): ("todays_change_perc", True),
+    ("todays_change", "asc"): ("todays_change_perc", False),
+    ("perc_diff", "desc"): ("dma_200_perc_diff", True),
+    ("perc_diff", "asc"): ("dma_200_perc_diff", False),
+}
+
+def get_color_bands(perc_diff):
+    """
+    Returns the boolean masks of the filter colours of the 200-DMA % diffs,
+    a missing value (NaN) is in none of them.
+    """
+    return {
+        "dark_green": perc_diff >= 10,
+        "green": (perc_diff >= 2) & (perc_diff < 10),
+        "yellow": (perc_diff >= -2) & (perc_diff < 2),
+        "red": (perc_diff >= -10) & (perc_diff < -2),
+        "dark_red": perc_diff < -10,
+    }
+
+def sort_permutation(values, descending):
+    """
+    Returns the order of the values, missing ones first in ascending order
+    and last in descending order (like SQLite and MySQL sort NULLs), and
+    ties in their current order. Strings are compared case-insensitively,
+    like the MySQL collation of the stock names.
+    """
+    if isinstance(values, np.ndarray):
+        keys = np.where(np.isnan(values), -np.inf, values)
+        return np.argsort(-keys if descending else keys, kind="stable")
+    order = sorted(range(len(values)), key=lambda i: (values[i] is not None, (values[i] or "").casefold()), reverse=descending)
+    return np.array(order, dtype=int)
+
+class IndexView:
+    """
+    Holdings of an index with the stock values shown on the index page,
+    loaded once per data generation: the rows, the numeric columns as numpy
+    arrays, the masks of the filter colours, and the permutation of the
+    rows for every sort option. A page is then a few vectorized operations
+    instead of a join query. The index is a plain row of INDEX_COLUMNS,
+    the view outlives the session of the request that loaded it.
+    """
+    def __init__(self, index, rows):
+        self.index = index
+        self.rows = rows
+        self.columns = {
+            "weight": np.array([row.weight for row in rows], dtype=float),
+            "stock_name": [row.stock_name for row in rows],
+            "todays_change_perc": np.array([row.todays_change_perc for row in rows], dtype=float),
+            "dma_200_perc_diff": np.array([row.dma_200_perc_diff for row in rows], dtype=float),
+        }
+        perc_diff = self.columns["dma_200_perc_diff"]
+        self.color_bands = get_color_bands(perc_diff)
+        self.missing_perc_diff = np.isnan(perc_diff)
+        self.permutations = {
+            option: sort_permutation(self.columns[column], descending)
+            for option, (column, descending) in SORT_OPTIONS.items()
+        }
+
+    def select(self, sort_by, order, filter_by, include_missing):
+        """
+        :param sort_by: sort option (see SORT_OPTIONS), None for the weight
+        :param order: "asc" or "desc"
+        :param filter_by: list of filter colours to keep
+        :param include_missing: also keep the stocks without a 200-DMA % diff
+        :return: list of the selected rows, in order
+        """
+        mask = np.zeros(len(self.rows), dtype=bool)
+        for color in filter_by:
+            mask |= self.color_bands[color]
+        if include_missing:
+            mask |= self.missing_perc_diff
+
+        permutation = self.permutations.get((sort_by, order), self.permutations[(None, None)])
+        return [self.rows[i] for i in permutation[mask[permutation]]]
+
+def load_index_view(index_id):
     # Fetch index
-    index = Index.query.filter_by(slug=index_id).first_or_404()
+    index = db.session.execute(db.select(*INDEX_COLUMNS).filter_by(slug=index_id)).first()
+    if index is None:
+        abort(404)
 
-    query = (
+    rows = (
         db.session.query(
             IndexHolding.weight,
             Stock.ticker,
@@ -75,23 +156,35 @@ def get_index_data(index_id, sort_by, order, filter_by):
         )
         .join(Stock, IndexHolding.stock_id == Stock.id)
         .filter(IndexHolding.index_id == index.id)
+        .order_by(IndexHolding.weight.desc())
+        .all()
     )
+    return IndexView(index, rows)
 
-    # Only include NULLs if all filters are selected
-    if set(filter_by) == valid_filter:
-        query = query.filter(or_(*filter_conditions, Stock.dma_200_perc_diff.is_(None)))
-    else:
-        query = query.filter(or_(*filter_conditions))
+# Index views of the current data generation, by index slug
+index_views = {"generation": None, "views": {}}
+index_views_lock = threading.Lock()
 
-    index_data = query.order_by(
-        sort_options.get((sort_by, order), IndexHolding.weight.desc())
-    ).all()
+def verify_index(index_id):
+    # To verify if the given index is valid, 404 otherwise
+    get_index_view(index_id)
 
-    result = {
-        "index": index,
-        "index_data": index_data,
-        "sort_dropdown_options": sort_dropdown_options,
-        "filter_colors": filter_colors
-    }
+def get_index_view(index_id):
+    generation = db_generation()
+    with index_views_lock:
+        if index_views["generation"] == generation:
+            index_view = index_views["views"].get(index_id)
+            if index_view is not None:
+                return index_view
+
+    # Loaded outside the lock, so the first requests of different indices do not wait on each other
+    index_view = load_index_view(index_id)
 
-    return result
\ No newline at end of file
+    # Not kept when populate db updated the data during the query
+    if db_generation() == generation:
+        with index_views_lock:
+            if index_views["generation"] != generation:
+                index_views["views"] = {}
+                index_views["generation"] = generation
+            index_views["views"][index_id] = index_view
+    return index_view
@@ -1,20 +1,32 @@
-from datetime import datetime
-from models.database import StockMaster, Stock
+import bisect
+import threading
+from collections import namedtuple
+import numpy as np
+from models.database import db, StockMaster, Stock
 from flask import abort
-from data_collectors.stock_data import fetch_stock_data, fetch_chart_data, TIMEFRAME_OPTIONS, SELECT_DB_TABLE, \
-    DB_TIMEFRAMES
-from utils.datetime_utils import DATE_FORMAT
-from utils.populate_db_info import db_last_updated_date
+from data_collectors.stock_data import fetch_stock_data, fetch_chart_rows, TIMEFRAME_OPTIONS, SELECT_DB_TABLE, \
+    get_chart_columns, get_parent_timeframe, get_timeframe_start
+from utils.datetime_utils import to_naive_et
+from utils.populate_db_info import db_last_updated_date, db_generation
+from utils.query_cache import cached_query
+from utils.chart_store import get_chart_store
+from utils.cold_cache import cold_cache
+from utils.downsampling import lttb_indices
 
+@cached_query
 def get_stock_data(ticker):
     verify_ticker(ticker)
 
     # Check if the stock is present in the database
     stock = Stock.query.filter_by(ticker=ticker).first()
-    # if not in db then use stock data collector script to get stock data
-    if not stock:
-        stock = fetch_stock_data(ticker)
+    if stock:
+        return get_stock_result(stock)
+
+    # if not in db then use stock data collector script to get stock data,
+    # kept on disk for the next visitors of the stock
+    return cold_cache.get_or_fetch(("stock", ticker), lambda: get_stock_result(fetch_stock_data(ticker)))
 
+def get_stock_result(stock):
     # Get the list of related companies
     rel_companies = []
     if stock and stock.related_companies:
@@ -27,24 +39,110 @@ def get_stock_data(ticker):
     }
     return result
 
+@cached_query
 def get_chart_data(ticker, timeframe):
     verify_ticker(ticker)
-    timeframe_data = TIMEFRAME_OPTIONS[timeframe]
+    verify_timeframe(timeframe)
     now = db_last_updated_date()
 
-    stock = Stock.query.filter_by(ticker=ticker).first()
-    if stock:
-        stock_id = stock.id
-        db_table = SELECT_DB_TABLE.get(timeframe_data["timespan"])
-        query = db_table.query.filter_by(stock_id=stock_id)
-        if timeframe not in DB_TIMEFRAMES:
-            before = timeframe_data.get("before")(datetime.strptime(now, DATE_FORMAT))
-            query = query.filter(db_table.date >= before)
-        chart_data = query.order_by(db_table.date.asc()).all()
-    else:
-        stock = Stock(ticker=ticker)
-        chart_data = fetch_chart_data(stock, timeframe)
+    # Charts of the stocks in the database, precomputed by populate db
+    store = get_chart_store()
+    result = store.get_payload(ticker, timeframe, now) if store else None
+    if result is not None:
+        return result
+
+    # Other timeframes are the end of the bars of their parent timeframe,
+    # read once for all of them
+    chart_data = get_chart_bars(ticker, get_parent_timeframe(timeframe))
+    return build_chart_result(slice_timeframe(chart_data, timeframe, now), timeframe)
+
+# Series of the chart data with one value per bar
+CHART_SERIES = ["date_data", "close_price_data", "volume_data", "ema_30_data", "ema_50_data", "ema_200_data"]
 
+@cached_query
+def get_downsampled_chart_data(ticker, timeframe, max_points):
+    """
+    Returns the chart data of get_chart_data with at most max_points bars,
+    picked by LTTB on the close prices. The dates, volumes and EMAs of the
+    kept bars are kept with them, so all the series stay aligned.
+    """
+    result = get_chart_data(ticker, timeframe)
+    close_prices = np.array(result["close_price_data"], dtype=float)
+    indices = lttb_indices(close_prices, max_points)
+    if len(indices) == len(close_prices):
+        return result
+
+    downsampled = dict(result)
+    for series in CHART_SERIES:
+        if result[series]:
+            downsampled[series] = [result[series][index] for index in indices]
+    return downsampled
+
+# Max number of tickers in one batch of chart data
+MAX_BATCH_TICKERS = 20
+
+@cached_query
+def get_batch_chart_data(tickers, timeframes):
+    """
+    Returns the chart data of several tickers and timeframes at once, as
+    {ticker: {timeframe: chart data}} (see get_chart_data). Unknown tickers
+    and timeframes are left out, and only the first MAX_BATCH_TICKERS
+    tickers are kept. The bars that are not in the chart store are read
+    with one query per bar table for all the tickers.
+
+    Tickers not in the database are left out too, their charts come from
+    the Polygon API one at a time and are requested with /chart-data.
+    """
+    valid_tickers = get_valid_tickers()
+    tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker in valid_tickers][:MAX_BATCH_TICKERS]
+    timeframes = [timeframe for timeframe in dict.fromkeys(timeframes) if timeframe in TIMEFRAME_OPTIONS]
+    now = db_last_updated_date()
+    result = {ticker: {} for ticker in tickers}
+
+    # Charts of the stocks in the database, precomputed by populate db
+    store = get_chart_store()
+    missing = []
+    for ticker in tickers:
+        for timeframe in timeframes:
+            chart_result = store.get_payload(ticker, timeframe, now) if store else None
+            if chart_result is None:
+                missing.append((ticker, timeframe))
+            else:
+                result[ticker][timeframe] = chart_result
+
+    # Tickers missing from the store, by parent timeframe, without the ones not in the database
+    if missing:
+        missing_tickers = list(dict.fromkeys(ticker for ticker, _ in missing))
+        db_tickers = set(db.session.execute(db.select(Stock.ticker).where(Stock.ticker.in_(missing_tickers))).scalars())
+        for ticker in missing_tickers:
+            if ticker not in db_tickers:
+                del result[ticker]
+        missing = [(ticker, timeframe) for ticker, timeframe in missing if ticker in db_tickers]
+    parent_tickers = {}
+    for ticker, timeframe in missing:
+        parent_tickers.setdefault(get_parent_timeframe(timeframe), {})[ticker] = None
+    chart_bars = {
+        parent: get_batch_chart_bars(list(parent_tickers[parent]), parent)
+        for parent in parent_tickers
+    }
+    for ticker, timeframe in missing:
+        chart_data = chart_bars[get_parent_timeframe(timeframe)][ticker]
+        result[ticker][timeframe] = build_chart_result(slice_timeframe(chart_data, timeframe, now), timeframe)
+    return result
+
+def slice_timeframe(chart_data, timeframe, now):
+    """
+    Returns the bars of the timeframe from the bars of its parent timeframe
+    (see get_parent_timeframe), found by binary search on their dates.
+    """
+    if timeframe == get_parent_timeframe(timeframe):
+        return chart_data
+    before = get_timeframe_start(timeframe, now)
+    start = bisect.bisect_left(chart_data, before, key=lambda data: to_naive_et(data.date))
+    return chart_data[start:]
+
+def build_chart_result(chart_data, timeframe):
+    timeframe_data = TIMEFRAME_OPTIONS[timeframe]
     ema_data = timeframe_data.get("ema_data")
     date_format = timeframe_data["date_format"]
     date_data = []
@@ -78,10 +176,72 @@ def get_chart_data(ticker, timeframe):
     }
     return result
 
+# One bar of a chart, the EMAs are None for the timeframes without them
+ChartBar = namedtuple("ChartBar", ["date", "close_price", "volume", "ema_30", "ema_50", "ema_200"],
+                      defaults=[None, None, None])
+
+@cached_query
+def get_chart_bars(ticker, timeframe):
+    """
+    Returns the chart bars (ChartBar) of the ticker for a DB timeframe,
+    ordered by date, from the database or else from the Polygon API.
+    """
+    columns = get_chart_columns(timeframe)
+    stock = Stock.query.filter_by(ticker=ticker).first()
+    if stock:
+        db_table = SELECT_DB_TABLE.get(TIMEFRAME_OPTIONS[timeframe]["timespan"])
+        rows = db.session.execute(
+            db.select(*[getattr(db_table, column) for column in columns])
+            .filter_by(stock_id=stock.id)
+            .order_by(db_table.date.asc())
+        ).all()
+    else:
+        rows = cold_cache.get_or_fetch(("chart", ticker, timeframe), lambda: fetch_chart_rows(ticker, timeframe))
+    return [ChartBar(*row) for row in rows]
+
+def get_batch_chart_bars(tickers, timeframe):
+    """
+    Returns {ticker: chart bars} of stocks in the database for a DB
+    timeframe, read with one query for all the tickers (see get_chart_bars
+    for the stocks not in the database).
+    """
+    columns = get_chart_columns(timeframe)
+    db_table = SELECT_DB_TABLE.get(TIMEFRAME_OPTIONS[timeframe]["timespan"])
+    chart_bars = {ticker: [] for ticker in tickers}
+    rows = db.session.execute(
+        db.select(Stock.ticker, *[getattr(db_table, column) for column in columns])
+        .join(Stock, db_table.stock_id == Stock.id)
+        .where(Stock.ticker.in_(tickers))
+        .order_by(db_table.stock_id, db_table.date.asc())
+    ).all()
+    for ticker, *values in rows:
+        chart_bars[ticker].append(ChartBar(*values))
+    return chart_bars
+
+# Tickers of the stock master of the current data generation, reloaded when populate db updates the data
+valid_tickers = {"generation": None, "tickers": frozenset()}
+valid_tickers_lock = threading.Lock()
+
+def load_valid_tickers():
+    # In upper case, like the tickers of the routes
+    return frozenset(ticker.upper() for ticker in db.session.execute(db.select(StockMaster.ticker)).scalars())
+
+def get_valid_tickers():
+    generation = db_generation()
+    with valid_tickers_lock:
+        if valid_tickers["generation"] != generation:
+            valid_tickers["tickers"] = load_valid_tickers()
+            valid_tickers["generation"] = generation
+        return valid_tickers["tickers"]
+
 def verify_ticker(ticker):
-    # To verify if the given ticker is valid
-    stock = StockMaster.query.filter_by(ticker=ticker).first()
-    if not stock:
+    # To verify if the given ticker is valid, in any case
+    if ticker.upper() not in get_valid_tickers():
+        abort(404)
+
+def verify_timeframe(timeframe):
+    # To verify if the given timeframe is valid
+    if timeframe not in TIMEFRAME_OPTIONS:
         abort(404)
 
 def get_timeframe_options():
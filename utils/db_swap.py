@@ -0,0 +1,31 @@
+import os
+from models.database import db
+
+def register_db_swap_handler(app):
+    """
+    populate_db can write a new SQLite database file and rename it over the
+    live one. Pooled connections keep reading the old (renamed away) file,
+    so before each request, check whether the file was replaced, and if so
+    dispose of the pool for the next connections to open the new file.
+    """
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return
+
+    db_path = os.path.abspath(url.database)
+    state = {"file_id": get_file_id(db_path)}
+
+    @app.before_request
+    def reopen_swapped_database():
+        file_id = get_file_id(db_path)
+        if file_id != state["file_id"]:
+            state["file_id"] = file_id
+            db.engine.dispose()
+
+def get_file_id(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
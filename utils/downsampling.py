@@ -0,0 +1,52 @@
+import numpy as np
+
+def lttb_indices(values, max_points):
+    """
+    Largest-Triangle-Three-Buckets downsampling of an evenly spaced series:
+    keeps the first and last points, splits the others into max_points - 2
+    buckets and keeps the point of each bucket forming the largest triangle
+    with the point kept in the previous bucket and the average of the next
+    bucket, which preserves the shape (peaks and dips) of the series.
+    The bucket averages and the triangle areas of each bucket are computed
+    with numpy, only the walk from bucket to bucket is a Python loop.
+    Missing values (NaN) are never kept unless a bucket has nothing else.
+    :param values: series to downsample (e.g. close prices)
+    :param max_points: max number of points to keep, at least 3
+    :return: numpy array of the indices of the points kept, in order
+    """
+    values = np.asarray(values, dtype=float)
+    num_values = len(values)
+    if max_points < 3 or num_values <= max_points:
+        return np.arange(num_values)
+
+    # Bucket b covers [edges[b], edges[b + 1]) of the values without the first and last one
+    num_buckets = max_points - 2
+    edges = (np.arange(num_buckets + 1) * (num_values - 2) / num_buckets).astype(int) + 1
+    edges[-1] = num_values - 1
+
+    # Average point of every bucket, and of the last point as the one after the last bucket
+    x = np.arange(num_values, dtype=float)
+    filled = np.where(np.isnan(values), 0.0, values)
+    counts = np.add.reduceat(~np.isnan(values[1:-1]), edges[:-1] - 1)
+    sums = np.add.reduceat(filled[1:-1], edges[:-1] - 1)
+    averages_y = np.append(np.where(counts > 0, sums / np.maximum(counts, 1), np.nan), values[-1])
+    averages_x = np.append((edges[:-1] + edges[1:] - 1) / 2, num_values - 1)
+
+    kept = np.empty(max_points, dtype=int)
+    kept[0] = 0
+    kept[-1] = num_values - 1
+    previous = 0
+    for bucket in range(num_buckets):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = averages_x[bucket + 1], averages_y[bucket + 1]
+        if np.isnan(next_y):
+            next_y = values[previous]
+        # Twice the triangle areas, the factor does not change the largest one
+        areas = np.abs(
+            (x[previous] - next_x) * (values[start:end] - values[previous])
+            - (x[previous] - x[start:end]) * (next_y - values[previous])
+        )
+        areas = np.where(np.isnan(areas), -1.0, areas)
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
@@ -0,0 +1,84 @@
+import functools
+import hashlib
+import os
+from flask import current_app, make_response, request
+from utils.populate_db_info import db_generation, db_last_modified
+
+# Cache-Control of the routes, the data only changes when populate db runs
+PAGE_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+DATA_CACHE_CONTROL = "public, max-age=300"
+
+# Version of the templates and static files, computed once
+app_version = {}
+
+def get_app_version():
+    """
+    Returns a hash of the paths and modification times of the templates and
+    static files, so that the validators change when a deploy changes them.
+    """
+    root_path = current_app.root_path
+    if root_path not in app_version:
+        digest = hashlib.md5()
+        for folder in ("templates", "static"):
+            for dir_path, _, file_names in sorted(os.walk(os.path.join(root_path, folder))):
+                for file_name in sorted(file_names):
+                    path = os.path.join(dir_path, file_name)
+                    digest.update(f"{path}:{os.stat(path).st_mtime_ns}".encode())
+        app_version[root_path] = digest.hexdigest()[:12]
+    return app_version[root_path]
+
+def make_etag():
+    # The responses only change with the data generation and the app version
+    return f"{db_generation()}-{get_app_version()}"
+
+def make_url_etag():
+    # ETag of the response of the requested URL, different for every URL
+    url_hash = hashlib.md5(request.full_path.encode()).hexdigest()[:12]
+    return f"{make_etag()}-{url_hash}"
+
+def is_not_modified(etag, last_modified):
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+def conditional(cache_control, validate=None):
+    """
+    Decorator of the routes serving data that only changes when populate db
+    runs: sends an ETag (URL, data generation and app version) and a
+    Last-Modified (last populate db run) with the successful responses, and
+    answers a request that already has the current response with a 304
+    before the view (and its queries) runs.
+    :param cache_control: Cache-Control header of the responses
+    :param validate: function called with the arguments of the view before
+        a 304, aborting with the error the view would return (e.g. 404 for
+        an unknown ticker), so an invalid URL never gets a 304
+    """
+    def decorator(view):
+        # Headers the view varies on (see utils.compression), also sent with the 304
+        vary = getattr(view, "vary", [])
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = make_url_etag()
+            last_modified = db_last_modified()
+            if is_not_modified(etag, last_modified):
+                if validate:
+                    validate(*args, **kwargs)
+                response = make_response("", 304)
+                for header in vary:
+                    response.vary.add(header)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers["Cache-Control"] = cache_control
+            return response
+        return wrapper
+    return decorator
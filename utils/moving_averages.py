@@ -0,0 +1,84 @@
+import numpy as np
+
+# Number of bars processed together by the vectorized EMA. The weights
+# inside a block grow as (1 - alpha) ** -block_size, so keep it small
+# enough to never overflow even for the shortest windows.
+EMA_BLOCK_SIZE = 64
+
+def ema(closes, windows, initial=None):
+    """
+    Computes the exponential moving averages of the given close prices
+    for all the given windows in one vectorized pass, using the usual
+    smoothing factor alpha = 2 / (window + 1).
+    Without 'initial', each EMA is seeded with the simple average of its
+    first 'window' closes, and is NaN before that. With 'initial', the EMAs
+    continue from those values (the EMAs of the bar just before closes[0]).
+    :param closes: close prices in chronological order
+    :param windows: list of EMA windows, e.g. [30, 50, 200]
+    :param initial: optional list of previous EMA values, one per window
+    :return: numpy array of shape (len(windows), len(closes))
+    """
+    closes = np.asarray(closes, dtype=float)
+    windows = np.asarray(windows, dtype=int)
+    if np.any(windows < 2):
+        raise ValueError("EMA windows must be at least 2")
+
+    num_bars = len(closes)
+    alpha = 2.0 / (windows + 1)
+    decay = 1.0 - alpha
+
+    # The EMA recursion is y[t] = decay * y[t-1] + alpha * u[t]. Without a
+    # previous value, start from 0 and make u[t] the SMA seed (divided by
+    # alpha) at the seed index, and 0 before it, so y[seed] == SMA.
+    inputs = np.broadcast_to(closes, (len(windows), num_bars)).copy()
+    if initial is None:
+        previous = np.zeros(len(windows))
+        seed_index = windows - 1
+        cumulative = np.cumsum(closes)
+        for row, window in enumerate(windows):
+            if window > num_bars:
+                inputs[row] = 0.0
+                continue
+            inputs[row, :window - 1] = 0.0
+            inputs[row, window - 1] = cumulative[window - 1] / window / alpha[row]
+    else:
+        previous = np.asarray(initial, dtype=float)
+        seed_index = np.zeros(len(windows), dtype=int)
+
+    # Closed form of the recursion inside each block of bars:
+    # y[b+k] = decay^(k+1) * y[b-1] + alpha * decay^k * cumsum(decay^-j * u[b+j])
+    result = np.empty((len(windows), num_bars))
+    steps = np.arange(EMA_BLOCK_SIZE)
+    powers = decay[:, None] ** steps[None, :]
+    inverse_powers = 1.0 / powers
+    for block_start in range(0, num_bars, EMA_BLOCK_SIZE):
+        block = inputs[:, block_start:block_start + EMA_BLOCK_SIZE]
+        size = block.shape[1]
+        weighted_sum = np.cumsum(block * inverse_powers[:, :size], axis=1)
+        values = powers[:, :size] * (alpha[:, None] * weighted_sum + decay[:, None] * previous[:, None])
+        result[:, block_start:block_start + size] = values
+        previous = values[:, -1]
+
+    # Not enough closes to seed these EMAs yet
+    not_seeded = np.arange(num_bars)[None, :] < seed_index[:, None]
+    result[not_seeded] = np.nan
+    return result
+
+def sma_latest(closes, windows):
+    """
+    Computes the simple moving average of the latest 'window' close prices
+    for all the given windows. If there are fewer closes than the window,
+    all of them are averaged.
+    :param closes: close prices in chronological order
+    :param windows: list of SMA windows, e.g. [30, 50, 200]
+    :return: list of averages, one per window (None if there are no closes)
+    """
+    closes = np.asarray(closes, dtype=float)
+    if len(closes) == 0:
+        return [None for _ in windows]
+
+    # Sum of the last n closes is cumulative[-1] - cumulative[-n-1]
+    cumulative = np.concatenate(([0.0], np.cumsum(closes)))
+    counts = np.minimum(np.asarray(windows, dtype=int), len(closes))
+    averages = (cumulative[-1] - cumulative[-counts - 1]) / counts
+    return averages.tolist()
@@ -1,20 +1,59 @@
 import json
+import os
+import threading
+from datetime import datetime, timezone
 from pathlib import Path
 
+POPULATE_DB_INFO_FILE = "populate_db_info.json"
+
+# Last loaded populate db info, reloaded when the file changes
+populate_db_info = {"file_id": None, "info": {}}
+populate_db_info_lock = threading.Lock()
+
+def get_data_dir():
+    # Folder of the JSON files shared by the scripts and the app,
+    # DATA_DIR in the environment or the data folder of the project
+    data_dir = os.getenv("DATA_DIR")
+    if data_dir:
+        return Path(data_dir)
+    return Path(__file__).resolve().parent.parent / "data"
+
+def load_populate_db_info():
+    """
+    Returns the info saved by the last populate db run. The file is only
+    read again when it changes, so this is cheap enough to call on every
+    request.
+    """
+    data_path = get_data_dir() / POPULATE_DB_INFO_FILE
+    try:
+        stat = data_path.stat()
+    except OSError:
+        return {}
+
+    file_id = (str(data_path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with populate_db_info_lock:
+        if populate_db_info["file_id"] != file_id:
+            with open(data_path) as f:
+                populate_db_info["info"] = json.load(f)
+            populate_db_info["file_id"] = file_id
+        return populate_db_info["info"]
+
 def db_last_updated():
     # Return the last updated timestamp of populate db
-    last_updated = None
-    data_path = Path(__file__).resolve().parent.parent / "data" / "populate_db_info.json"
-    if data_path.exists():
-        with open(data_path) as f:
-            last_updated = json.load(f).get("last_updated")
-    return last_updated
+    return load_populate_db_info().get("last_updated")
 
 def db_last_updated_date():
     # Return the last updated date of populate db
-    last_updated_date = None
-    data_path = Path(__file__).resolve().parent.parent / "data" / "populate_db_info.json"
-    if data_path.exists():
-        with open(data_path) as f:
-            last_updated_date = json.load(f).get("last_updated_date")
-    return last_updated_date
\ No newline at end of file
+    return load_populate_db_info().get("last_updated_date")
+
+def db_generation():
+    # Return the data generation of populate db, bumped every time it changes the data
+    return load_populate_db_info().get("generation", 0)
+
+def db_last_modified():
+    # Return the time populate db last saved its info (in UTC), None before its first run
+    try:
+        mtime = (get_data_dir() / POPULATE_DB_INFO_FILE).stat().st_mtime
+    except OSError:
+        return None
+    return datetime.fromtimestamp(int(mtime), tz=timezone.utc)
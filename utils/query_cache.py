@@ -0,0 +1,115 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from utils.populate_db_info import db_generation
+
+# Max number of query results kept in memory, the least recently used ones are dropped first
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024"))
+
+# Seconds a query result is served from memory (0 = until populate db changes the data).
+# Mostly matters for the stocks that are not in the database, fetched from the API.
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+class QueryCache:
+    """
+    LRU cache of the results of the database queries of the app, keyed on
+    the query and its arguments. Every populate db run bumps the data
+    generation (see utils.populate_db_info), and all the results of the
+    previous generation are dropped as soon as the new one is seen, so the
+    cache never serves data older than the database.
+    """
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, ttl=QUERY_CACHE_TTL):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, result)
+        self.generation = None
+        self.hits = {}
+        self.misses = {}
+
+    def check_generation(self):
+        # Called with the lock held
+        generation = db_generation()
+        if generation != self.generation:
+            self.entries.clear()
+            self.generation = generation
+
+    def get(self, name, key):
+        """
+        Returns (True, result) if the result of the query is cached,
+        otherwise (False, None).
+        """
+        with self.lock:
+            self.check_generation()
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self.entries.move_to_end(key)
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses[name] = self.misses.get(name, 0) + 1
+            return False, None
+
+    def set(self, key, result, generation):
+        with self.lock:
+            # The data changed while the query was running, the result may be stale
+            if generation != self.generation:
+                return
+            expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+            self.entries[key] = (expires_at, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        :return: dict of query name -> {"hits", "misses", "hit_rate"}, plus the
+            number of cached entries and the data generation they belong to
+        """
+        with self.lock:
+            queries = {}
+            for name in sorted(set(self.hits) | set(self.misses)):
+                hits = self.hits.get(name, 0)
+                misses = self.misses.get(name, 0)
+                queries[name] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+            return {"entries": len(self.entries), "generation": self.generation, "queries": queries}
+
+query_cache = QueryCache()
+
+def make_key(name, args, kwargs):
+    # Lists (e.g. the filters of an index) are not hashable
+    def normalize(value):
+        return tuple(value) if isinstance(value, list) else value
+    return (
+        name,
+        tuple(normalize(arg) for arg in args),
+        tuple(sorted((key, normalize(value)) for key, value in kwargs.items())),
+    )
+
+def cached_query(func):
+    """
+    Serves the results of a query function from the query cache. The
+    results are shared between requests and must not be modified. Errors
+    (e.g. the 404 of an unknown ticker) are not cached.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = make_key(name, args, kwargs)
+        found, result = query_cache.get(name, key)
+        if found:
+            return result
+        generation = query_cache.generation
+        result = func(*args, **kwargs)
+        query_cache.set(key, result, generation)
+        return result
+
+    return wrapper